@@ -0,0 +1,326 @@
+"""
+This module caches whole answers. Most questions are first turns that do not depend on the
+conversation, and the same ones are asked again and again ("Who played in The Matrix?", then
+"Who played in the matrix?"), each time paying for the full agent loop: two or more GPT round trips
+and the graph lookups in between. Here the final output of a turn is remembered and returned
+directly the next time the same question is asked in an equivalent conversation.
+
+Key Components:
+- `is_context_dependent`: Tells whether the answer to a question may depend on the conversation.
+  Any question asked after earlier turns may ("What other movies have they been a part of?", but
+  also "And Cloud Atlas?"), so only first turns are cached.
+- `answer_key`: Builds the cache key from the normalized question, a fingerprint of the pinned
+  feedback instructions (the only part of the history that changes an independent answer) and the
+  graph version the answer was produced from.
+- AnswerCache: A thread-safe LRU mapping from key to answer with a TTL, mirrored to a backend.
+- Backends: JsonFileBackend rewrites a single JSON file, which suits small caches, and merges the
+  entries other processes wrote to it under a file lock, so server workers and batch runs can
+  share the file; DbmBackend writes each entry to a `dbm` database, so large caches are not
+  rewritten on every answer, but serves a single process. Any object with the same `load`, `put`,
+  `delete` and `clear` methods can be plugged in.
+
+Functionality:
+- Answers are keyed on the graph version, so a change to the graph makes every earlier answer
+  unreachable; the stale entries are evicted as new answers come in.
+
+Usage:
+- `main.respond`, `main.aget_chat_response` and `main.astream_chat_response` look the question up
+  before the fast path and the agent, and store the output of the turn afterwards.
+"""
+
+
+# Standard library imports
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+import dbm
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Without advisory locks (Windows), concurrent writers may still drop each other's entries
+    fcntl = None
+
+# Application-specific imports
+from cypher_cache import normalize_question
+
+
+def is_context_dependent(user_input: str, chat_history=None) -> bool:
+    """
+    Tell whether the answer to a question may depend on the earlier turns of the conversation.
+
+    Parameters:
+        user_input (str): The natural language input from a user.
+        chat_history (HistoryManager): The conversation so far.
+
+    Returns:
+        bool: True when the conversation has turns. Follow-ups need not name what they refer to
+            ("Which year?", "What about Cloud Atlas?"), so no question after the first is shared.
+    """
+    return chat_history is not None and chat_history.has_turns()
+
+
+def answer_key(user_input: str, chat_history=None, version=None) -> str:
+    """
+    Build the cache key of a question.
+
+    Parameters:
+        user_input (str): The natural language input from a user.
+        chat_history (HistoryManager): The conversation so far; only its pinned feedback counts.
+        version (Tuple): The current graph version stamp, or None if it is unknown.
+
+    Returns:
+        str: A hex digest identifying the question, the feedback and the graph version.
+    """
+    pinned = chat_history.pinned if chat_history is not None else []
+    material = json.dumps([normalize_question(user_input), pinned, version], default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]
+
+
+class JsonFileBackend():
+    """
+    Persists the entries of an AnswerCache to a single JSON file, rewritten on every change.
+
+    Several processes may share the file: every write locks it, merges the entries written by the
+    others since and replaces the file through a temporary file of its own.
+
+    Attributes:
+        path (str): The JSON file.
+        maxsize (Optional[int]): The maximum number of entries kept in the file, the oldest going
+            first, or None for no bound.
+    """
+
+    def __init__(self, path: str, maxsize: Optional[int] = None):
+        self.path = path
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        # Changes since the last write, which must win over the entries found in the file
+        self._deleted = set()
+        self._cleared = False
+
+    def load(self) -> List[Tuple[str, str, float]]:
+        """Return the stored (key, answer, created) entries, least recently used first."""
+        self._entries = self._read()
+        return [(key, answer, created) for key, (answer, created) in self._entries.items()]
+
+    def put(self, key: str, answer: str, created: float) -> None:
+        self._entries[key] = (answer, created)
+        self._entries.move_to_end(key)
+        self._deleted.discard(key)
+        self._save()
+
+    def delete(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+            self._deleted.add(key)
+        self._save()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._deleted.clear()
+        self._cleared = True
+        self._save()
+
+    def _read(self) -> OrderedDict:
+        entries = OrderedDict()
+        if not os.path.exists(self.path):
+            return entries
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f).get("entries", [])
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable answer cache {self.path}: {e}")
+            return entries
+        for key, answer, created in stored:
+            entries[key] = (answer, created)
+        return entries
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            merged = OrderedDict()
+            if not self._cleared:
+                # Keep what other processes added, behind this process's more recent entries
+                for key, entry in self._read().items():
+                    if key not in self._deleted and key not in self._entries:
+                        merged[key] = entry
+            merged.update(self._entries)
+            while self.maxsize is not None and len(merged) > self.maxsize:
+                merged.popitem(last=False)
+            data = {"entries": [[key, answer, created] for key, (answer, created) in merged.items()]}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        self._deleted.clear()
+        self._cleared = False
+
+
+class DbmBackend():
+    """
+    Persists the entries of an AnswerCache to a `dbm` database, one record per entry.
+
+    A database belongs to a single process: `dbm` implementations allow no concurrent writers, so
+    the database is locked while it is open, and a second process opening it gets an OSError.
+    Processes sharing a cache should use JsonFileBackend, or each be given their own path.
+
+    Attributes:
+        path (str): The database file, as passed to `dbm.open`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(f"{path}.lock", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise OSError(f"The answer cache {path} is in use by another process")
+        try:
+            self._db = dbm.open(path, "c")
+        except dbm.error as e:
+            self._lock_file.close()
+            raise OSError(f"Cannot open the answer cache {path}: {e}") from e
+
+    def load(self) -> List[Tuple[str, str, float]]:
+        """Return the stored (key, answer, created) entries, least recently used first."""
+        entries = []
+        for key in self._db.keys():
+            try:
+                answer, created = json.loads(self._db[key])
+            except ValueError:
+                continue
+            entries.append((key.decode("utf-8"), answer, created))
+        # Recency is not recorded per read, so the oldest answers are the first to go
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def put(self, key: str, answer: str, created: float) -> None:
+        self._db[key] = json.dumps([answer, created])
+        self._sync()
+
+    def delete(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            try:
+                del self._db[key]
+            except KeyError:
+                pass
+        self._sync()
+
+    def clear(self) -> None:
+        self.delete([key.decode("utf-8") for key in self._db.keys()])
+
+    def _sync(self) -> None:
+        # Not every dbm implementation buffers writes; those that do expose `sync`
+        sync = getattr(self._db, "sync", None)
+        if sync is not None:
+            sync()
+
+
+class AnswerCache():
+    """
+    A size- and age-bounded mapping from answer key to the final output of a turn.
+
+    Attributes:
+        backend (Optional[JsonFileBackend]): Where the entries are persisted, or None to keep
+            them in memory only.
+        maxsize (int): The maximum number of entries kept; the least recently used is evicted first.
+        ttl (float): The number of seconds after which an entry expires.
+    """
+
+    def __init__(self, backend=None, maxsize: int = 1024, ttl: float = 24 * 3600):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if backend is not None:
+            now = time.time()
+            for key, answer, created in backend.load():
+                if now - created <= ttl:
+                    self._entries[key] = (answer, created)
+            self._evict()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the cached answer for a key, or None when it is missing or expired.
+
+        Parameters:
+            key (str): The key built by `answer_key`.
+
+        Returns:
+            Optional[str]: The cached answer.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            answer, created = entry
+            if time.time() - created > self.ttl:
+                del self._entries[key]
+                self._persist("delete", [key])
+                return None
+            self._entries.move_to_end(key)
+            return answer
+
+    def put(self, key: str, answer: str) -> None:
+        """
+        Store the answer of a turn, evicting the least recently used entries beyond the size.
+
+        Parameters:
+            key (str): The key built by `answer_key`.
+            answer (str): The final output of the turn.
+        """
+        created = time.time()
+        with self._lock:
+            self._entries[key] = (answer, created)
+            self._entries.move_to_end(key)
+            self._persist("put", key, answer, created)
+            self._evict()
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._persist("clear")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self) -> None:
+        evicted = []
+        while len(self._entries) > self.maxsize:
+            evicted.append(self._entries.popitem(last=False)[0])
+        if evicted:
+            self._persist("delete", evicted)
+
+    def _persist(self, method: str, *args) -> None:
+        # The in-memory entries stay authoritative when the backend cannot be written
+        if self.backend is None:
+            return
+        try:
+            getattr(self.backend, method)(*args)
+        except OSError as e:
+            print(f"Failed to update the answer cache backend: {e}")
@@ -0,0 +1,318 @@
+"""
+This module answers large sets of questions offline, such as regression sets for evaluation or
+precomputed FAQ answers. demos.py runs its queries one at a time; here independent conversations
+run concurrently on one event loop, so throughput grows with the concurrency limit instead of being
+bound by one OpenAI round trip after another.
+
+Key Components:
+- `read_conversations`: Reads the questions of a JSON lines file and groups them into
+  conversations.
+- `read_checkpoint`: Reads the results already written by an interrupted run, so it can resume.
+- OrderedWriter: Writes results to the output JSON lines file in input order as soon as every
+  earlier result is known, flushing each line so the file is always a valid checkpoint.
+- BatchRunner: Runs conversations with a bounded pool of workers, retrying rate-limited and
+  transient OpenAI failures with exponential backoff. A rate limit pauses every worker, not only
+  the one that hit it, and honours the server's Retry-After header.
+
+Input format:
+- One JSON object per line with a `question` and optionally an `id` and a `conversation`. Lines
+  sharing a `conversation` are asked in file order with one chat history, so follow-up questions
+  work; lines without one are independent conversations. As in demos.py, a question starting with
+  "feedback:" is pinned to the conversation's history instead of being answered.
+
+Output format:
+- One JSON object per input line, in input order: its `index`, `id`, `conversation` and `question`,
+  then either the `output` or the `error`, and the `latency_ms` of the turn.
+
+Usage:
+- `python batch.py questions.jsonl answers.jsonl --concurrency 16`. Running the same command again
+  after an interruption resumes after the last result written and asks the failed questions again;
+  `--restart` starts over. The answer cache is bypassed unless `--answer-cache` is given, so every
+  question is answered anew.
+"""
+
+
+# Standard library imports
+from typing import Dict, List, NamedTuple, Optional, TextIO, Tuple
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+# Third-party imports
+import openai
+
+# Application-specific imports
+from llm import is_transient, retry_after
+import main
+
+
+FEEDBACK_REPLY = "Thank you for your feedback! We will try to improve."
+
+
+class IncompleteAnswer(Exception):
+    """The turn stopped without an answer, e.g. because it ran out of time."""
+
+
+class Question(NamedTuple):
+    """
+    One line of the input file.
+
+    Attributes:
+        index (int): The position of the line among the questions of the file.
+        id (Optional[str]): The id given in the input, if any.
+        conversation (Optional[str]): The conversation the question belongs to, if any.
+        question (str): The natural language input.
+    """
+    index: int
+    id: Optional[str]
+    conversation: Optional[str]
+    question: str
+
+
+def read_conversations(path: str) -> List[List[Question]]:
+    """
+    Read the questions of a JSON lines file, grouped into conversations.
+
+    Parameters:
+        path (str): The input file.
+
+    Returns:
+        List[List[Question]]: The conversations, ordered by their first question, each holding its
+            questions in file order.
+    """
+    conversations: Dict[object, List[Question]] = {}
+    index = 0
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict) or not isinstance(record.get("question"), str):
+                raise ValueError(f'{path}:{number}: expected an object with a "question" string')
+            conversation = record.get("conversation")
+            question = Question(index, record.get("id"), conversation, record["question"])
+            # Questions without a conversation are conversations of their own
+            conversations.setdefault(("named", conversation) if conversation is not None else index, []).append(question)
+            index += 1
+    return list(conversations.values())
+
+
+def read_checkpoint(path: str) -> Tuple[List[dict], int]:
+    """
+    Read the results an earlier run wrote to the output file.
+
+    Results are written in input order, so the complete lines of the file are the results of the
+    first questions. A line cut short by an interruption is ignored.
+
+    Parameters:
+        path (str): The output file.
+
+    Returns:
+        Tuple[List[dict], int]: The results found and the size in bytes of the lines before the
+            first failed result, which is where a resumed run continues writing.
+    """
+    results, size, failed = [], 0, False
+    if not os.path.exists(path):
+        return results, size
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n") or result.get("index") != len(results):
+                break
+            results.append(result)
+            failed = failed or "error" in result
+            if not failed:
+                size += len(line)
+    return results, size
+
+
+class OrderedWriter():
+    """
+    Writes results in input order, holding back those that finish before an earlier one.
+
+    Attributes:
+        f (TextIO): The output file.
+        next_index (int): The index of the next result to write.
+    """
+
+    def __init__(self, f: TextIO, next_index: int = 0):
+        self.f = f
+        self.next_index = next_index
+        self._pending: Dict[int, dict] = {}
+
+    def put(self, result: dict) -> None:
+        """Record a result and write every result that is now in order."""
+        self._pending[result["index"]] = result
+        while self.next_index in self._pending:
+            self.f.write(json.dumps(self._pending.pop(self.next_index)) + "\n")
+            self.next_index += 1
+        self.f.flush()
+
+
+class BatchRunner():
+    """
+    Answers conversations concurrently, writing each result through an OrderedWriter.
+
+    Attributes:
+        writer (OrderedWriter): Receives the result of every question.
+        concurrency (int): The number of conversations answered at the same time.
+        max_retries (int): Retries of a turn that failed with a transient error.
+        backoff (float): The first retry delay, in seconds, doubled on every retry.
+        max_backoff (float): The longest retry delay, in seconds.
+    """
+
+    def __init__(self, writer: OrderedWriter, concurrency: int = 8, max_retries: int = 6,
+                 backoff: float = 1.0, max_backoff: float = 60.0):
+        self.writer = writer
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.answered = 0
+        self.failed = 0
+        # Monotonic time until which no turn is started, pushed back by every rate limit
+        self._paused_until = 0.0
+
+    async def run(self, conversations: List[List[Question]], done: Dict[int, dict] = {}) -> None:
+        """
+        Answer every question not already in `done`.
+
+        Parameters:
+            conversations (List[List[Question]]): The conversations, as from `read_conversations`.
+            done (Dict[int, dict]): Successful results of an earlier run by question index. Their
+                turns are replayed into the chat history without asking the model again, and those
+                not yet written are written again in their place.
+        """
+        for index in sorted(done):
+            if index >= self.writer.next_index:
+                self.writer.put(done[index])
+        todo: asyncio.Queue = asyncio.Queue()
+        for conversation in conversations:
+            if any(question.index not in done for question in conversation):
+                todo.put_nowait(conversation)
+        workers = [asyncio.create_task(self._work(todo, done)) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _work(self, todo: asyncio.Queue, done: Dict[int, dict]) -> None:
+        while not todo.empty():
+            await self._answer_conversation(todo.get_nowait(), done)
+
+    async def _answer_conversation(self, conversation: List[Question], done: Dict[int, dict]) -> None:
+        chat_history = main.new_chat_history()
+        for question in conversation:
+            if question.question.startswith("feedback:"):
+                chat_history.add_feedback(question.question)
+                if question.index not in done:
+                    self.writer.put(self._result(question, output=FEEDBACK_REPLY, latency=0.0))
+                continue
+            if question.index in done:
+                if "output" in done[question.index]:
+                    chat_history.add_turn(question.question, done[question.index]["output"])
+                continue
+            started = time.perf_counter()
+            try:
+                response = await self._ask(question.question, chat_history)
+            except Exception as e:
+                self.failed += 1
+                self.writer.put(self._result(question, error=f"{type(e).__name__}: {e}",
+                                             latency=time.perf_counter() - started))
+                continue
+            chat_history.add_turn(question.question, response["output"])
+            self.answered += 1
+            self.writer.put(self._result(question, output=response["output"], latency=time.perf_counter() - started))
+
+    async def _ask(self, user_input: str, chat_history) -> dict:
+        for attempt in range(self.max_retries + 1):
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                response = await main.aget_chat_response(user_input, chat_history)
+            except Exception as e:
+                if not is_transient(e) or attempt == self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    # Full jitter keeps the workers from retrying in lockstep
+                    delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if isinstance(e, openai.RateLimitError):
+                    # The quota is shared, so every worker waits
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"Retrying in {delay:.1f}s after {type(e).__name__}: {e}")
+                await asyncio.sleep(delay)
+                continue
+            if main.is_incomplete(response):
+                # Recorded as a failure, so it stays out of the history and a resumed run asks again
+                raise IncompleteAnswer(response["output"])
+            return response
+
+    @staticmethod
+    def _result(question: Question, latency: float, output: str = None, error: str = None) -> dict:
+        result = {"index": question.index, "id": question.id, "conversation": question.conversation,
+                  "question": question.question}
+        if error is None:
+            result["output"] = output
+        else:
+            result["error"] = error
+        result["latency_ms"] = round(1000 * latency, 1)
+        return result
+
+
+async def run_batch(input_path: str, output_path: str, concurrency: int = 8, restart: bool = False,
+                    max_retries: int = 6) -> BatchRunner:
+    """
+    Answer the questions of an input file into an output file, resuming an interrupted run.
+
+    Parameters:
+        input_path (str): The questions, one JSON object per line.
+        output_path (str): The results, one JSON object per line, in input order.
+        concurrency (int): The number of conversations answered at the same time.
+        restart (bool): Ignore the results of an earlier run and start over.
+        max_retries (int): Retries of a turn that failed with a transient error.
+
+    Returns:
+        BatchRunner: The runner, with its `answered` and `failed` counts.
+    """
+    conversations = read_conversations(input_path)
+    results, size = ([], 0) if restart else read_checkpoint(output_path)
+    mode = "r+" if size else "w"
+    with open(output_path, mode, encoding="utf-8") as f:
+        # Drop whatever follows the last complete result, e.g. a line cut short by an interruption
+        f.truncate(size)
+        f.seek(size)
+        # Failed turns, e.g. rate limits or timeouts, are asked again: writing resumes at the first
+        # one, and the successful results after it are written again from memory
+        written = next((i for i, result in enumerate(results) if "error" in result), len(results))
+        runner = BatchRunner(OrderedWriter(f, next_index=written), concurrency, max_retries)
+        await runner.run(conversations, {result["index"]: result for result in results if "error" not in result})
+    return runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSON lines file of questions concurrently.")
+    parser.add_argument("input", help="questions, one JSON object per line")
+    parser.add_argument("output", help="results, one JSON object per line, in input order")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "8")),
+                        help="conversations answered at the same time")
+    parser.add_argument("--max-retries", type=int, default=6, help="retries of a rate-limited or failed turn")
+    parser.add_argument("--restart", action="store_true", help="ignore the results of an earlier run")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="serve repeated questions from the answer cache instead of answering them anew")
+    args = parser.parse_args()
+    # Evaluation runs must not replay answers stored by an earlier model or prompt
+    os.environ["ANSWER_CACHE"] = "1" if args.answer_cache else "0"
+    started = time.perf_counter()
+    runner = asyncio.run(run_batch(args.input, args.output, args.concurrency, args.restart, args.max_retries))
+    elapsed = time.perf_counter() - started
+    print(f"Answered {runner.answered} questions ({runner.failed} failed) in {elapsed:.1f}s, "
+          f"{runner.answered / max(elapsed, 1e-9):.2f} questions/s")
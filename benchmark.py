@@ -0,0 +1,428 @@
+"""
+This module benchmarks the chatbot pipeline offline. The language model and the Neo4j graph are
+replaced by deterministic stand-ins with configurable latency, so the cost of everything the
+application does around them (prompt building, entity resolution, caching, routing, the agent
+loop) can be measured reproducibly, in CI and without network access.
+
+Key Components:
+- FakeChatModel: A chat model that plays the agent (calling the Information tool with every
+  entity of the question, then answering from its result), the Cypher generator and the QA chain, sleeping for a fixed latency per call
+  and counting the prompt tokens it receives.
+- FakeGraph: An in-memory movie graph answering the queries in `prompts` the way Neo4j would,
+  including the context strings of `prompts.description_by_id_query`.
+- Stages: `pipeline` (main.respond, fast path included), `agent` (AgentExecutor.invoke),
+  `get_information`, `chain` (the GraphCypherQAChain) and `cached_chain` (its Cypher cache).
+
+Functionality:
+- Each stage replays the demo1-demo4 queries of demos.py plus a generated workload, and reports
+  p50/p95/p99 latency, throughput, prompt tokens, model calls and graph queries per operation.
+  A second pass under tracemalloc reports the peak and retained memory allocated per operation.
+
+Usage:
+- `python benchmark.py --llm-latency 50 --graph-latency 5 --json bench.json`
+- `python benchmark.py --baseline bench.json --tolerance 0.2` exits with status 1 when the p95
+  latency or the prompt tokens of a stage regressed by more than the tolerance.
+"""
+
+
+# Standard library imports
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Third-party imports
+from langchain_community.graphs.graph_store import GraphStore
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Application-specific imports
+import context_store
+from history import count_tokens
+import prompts
+
+
+# A small slice of the Neo4j movie graph: title -> (released, actors, directors)
+MOVIES = {
+    "The Matrix": (1999, ["Keanu Reeves", "Carrie-Anne Moss", "Laurence Fishburne", "Hugo Weaving"],
+                   ["Lana Wachowski", "Lilly Wachowski"]),
+    "The Matrix Reloaded": (2003, ["Keanu Reeves", "Carrie-Anne Moss", "Laurence Fishburne"],
+                            ["Lana Wachowski", "Lilly Wachowski"]),
+    "Cloud Atlas": (2012, ["Tom Hanks", "Halle Berry", "Hugo Weaving"], ["Tom Tykwer", "Lana Wachowski"]),
+    "Sleepless in Seattle": (1993, ["Tom Hanks", "Meg Ryan", "Rita Wilson"], ["Nora Ephron"]),
+    "You've Got Mail": (1998, ["Tom Hanks", "Meg Ryan", "Greg Kinnear"], ["Nora Ephron"]),
+    "The Polar Express": (2004, ["Tom Hanks"], ["Robert Zemeckis"]),
+    "Cast Away": (2000, ["Tom Hanks", "Helen Hunt"], ["Robert Zemeckis"]),
+    "A Few Good Men": (1992, ["Tom Cruise", "Jack Nicholson", "Demi Moore"], ["Rob Reiner"]),
+}
+
+
+class FakeGraph(GraphStore):
+    """
+    An in-memory stand-in for Neo4jGraph that answers the application's queries.
+
+    Attributes:
+        latency (float): Seconds slept per query, emulating the database round trip.
+        queries (int): The number of queries received.
+    """
+
+    def __init__(self, movies: Dict[str, tuple] = MOVIES, latency: float = 0.0):
+        self.latency = latency
+        self.queries = 0
+        self.schema = ("Node properties:\nMovie {title: STRING, released: INTEGER}\nPerson {name: STRING}\n"
+                       "The relationships:\n(:Person)-[:ACTED_IN]->(:Movie)\n(:Person)-[:DIRECTED]->(:Movie)")
+        self.structured_schema = {
+            "node_props": {"Movie": [{"property": "title", "type": "STRING"},
+                                     {"property": "released", "type": "INTEGER"}],
+                           "Person": [{"property": "name", "type": "STRING"}]},
+            "rel_props": {},
+            "relationships": [{"start": "Person", "type": "ACTED_IN", "end": "Movie"},
+                              {"start": "Person", "type": "DIRECTED", "end": "Movie"}],
+        }
+        self.nodes: Dict[str, dict] = {}
+        self.relationships: List[tuple] = []
+        ids: Dict[str, str] = {}
+
+        def node(label, name, released=None):
+            if name not in ids:
+                ids[name] = f"4:fake:{len(ids)}"
+                self.nodes[ids[name]] = {"label": label, "name": name, "released": released}
+            return ids[name]
+
+        for title, (released, actors, directors) in movies.items():
+            movie = node("Movie", title, released)
+            for rel_type, people in (("ACTED_IN", actors), ("DIRECTED", directors)):
+                for person in people:
+                    self.relationships.append((node("Person", person), rel_type, movie))
+
+    @property
+    def get_schema(self) -> str:
+        return self.schema
+
+    @property
+    def get_structured_schema(self) -> Dict[str, Any]:
+        return self.structured_schema
+
+    def refresh_schema(self) -> None:
+        pass
+
+    def add_graph_documents(self, graph_documents, include_source: bool = False) -> None:
+        raise NotImplementedError("The benchmark graph is read-only")
+
+    def query(self, query: str, params: dict = {}) -> List[Dict[str, Any]]:
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if query == prompts.entity_index_query:
+            return [{"id": node_id, "label": node["label"], "name": node["name"]}
+                    for node_id, node in self.nodes.items()]
+        if query == prompts.replica_nodes_query:
+            # No node carries `updatedAt`, so only full loads return anything
+            if params.get("since") is not None:
+                return []
+            return [{"id": node_id, "labels": [node["label"]], "title": node["name"] if node["label"] == "Movie" else None,
+                     "name": node["name"] if node["label"] == "Person" else None, "released": node["released"],
+                     "updated": None} for node_id, node in self.nodes.items()]
+        if query in (prompts.replica_relationships_query, prompts.replica_changed_relationships_query):
+            ids = set(params.get("ids") or self.nodes)
+            return [{"id": f"5:fake:{i}", "source": start, "type": rel_type, "target": end}
+                    for i, (start, rel_type, end) in enumerate(self.relationships) if start in ids or end in ids]
+        if query == prompts.all_contexts_query:
+            return [{"id": node_id, "context": self.context(node_id)} for node_id in self.nodes if self.context(node_id)]
+        if query == prompts.replica_counts_query:
+            return [{"nodes": len(self.nodes), "relationships": len(self.relationships)}]
+        if query == prompts.graph_version_query:
+            return [{"version": None, "nodes": len(self.nodes), "relationships": len(self.relationships)}]
+        if query == prompts.description_by_id_query:
+            context = self.context(params["id"])
+            return [{"context": context}] if context else []
+        if query == prompts.descriptions_by_ids_query:
+            return [{"id": node_id, "context": self.context(node_id)} for node_id in params["ids"] if self.context(node_id)]
+        if query == prompts.description_query:
+            for node_id, node in self.nodes.items():
+                if params["candidate"] in node["name"] and self.context(node_id):
+                    return [{"context": self.context(node_id)}]
+            return []
+        if query in (prompts.actors_by_id_query, prompts.directors_by_id_query):
+            rel_type = "ACTED_IN" if query == prompts.actors_by_id_query else "DIRECTED"
+            node = self.nodes.get(params["id"])
+            names = [self.nodes[start]["name"] for start, kind, end in self.relationships
+                     if end == params["id"] and kind == rel_type]
+            return [{"title": node["name"], "names": names}] if node and names else []
+        if query == prompts.movie_count_by_id_query:
+            node = self.nodes.get(params["id"])
+            if node is None or node["label"] != "Person":
+                return []
+            movies = sum(1 for start, kind, _ in self.relationships if start == params["id"] and kind == "ACTED_IN")
+            return [{"name": node["name"], "movies": movies}]
+        # Any generated Cypher: answer like an aggregate over the people in the graph
+        return [{"count": sum(1 for node in self.nodes.values() if node["label"] == "Person")}]
+
+    def context(self, node_id: str) -> Optional[str]:
+        """Build the context of a node exactly as `prompts.context_projection` does."""
+        node = self.nodes.get(node_id)
+        if node is None:
+            return None
+        neighbours = defaultdict(list)
+        for start, rel_type, end in self.relationships:
+            if start == node_id:
+                neighbours[rel_type].append(self.nodes[end]["name"])
+            elif end == node_id:
+                neighbours[rel_type].append(self.nodes[start]["name"])
+        if not neighbours:
+            return None
+        released = "" if node["released"] is None else str(node["released"])
+        return (f"type:{node['label']}\ntitle: {node['name']}\nyear: {released}\n"
+                + "".join(f"{rel_type}: {', '.join(names)}\n" for rel_type, names in neighbours.items()))
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A deterministic chat model standing in for GPT-4 in every role the application gives it.
+
+    Attributes:
+        latency (float): Seconds slept per call, emulating the OpenAI round trip.
+        entities (List[str]): Names the agent role recognizes in questions.
+        calls (int): The number of calls received.
+        prompt_tokens (int): The number of prompt tokens received over all calls.
+    """
+
+    latency: float = 0.0
+    entities: List[str] = []
+    calls: int = 0
+    prompt_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-movie-chat"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages)
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        self.calls += 1
+        prompt_tokens = sum(count_tokens(str(message.content)) for message in messages)
+        self.prompt_tokens += prompt_tokens
+        text = str(messages[-1].content)
+        if isinstance(messages[0], SystemMessage) and messages[0].content == prompts.agent_system_prompt:
+            message = self._agent_step(messages)
+        elif "Cypher query:" in text:
+            message = AIMessage(content="MATCH (p:Person) RETURN count(p) AS count")
+        elif "Progressively summarize" in text:
+            message = AIMessage(content="The user asked about movies and actors.")
+        else:
+            message = AIMessage(content="According to the graph, the answer is in the context provided.")
+        # Reported like ChatOpenAI does, so `metrics` records the tokens of each stage
+        token_usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(str(message.content))}
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": token_usage})
+
+    def _agent_step(self, messages: List[BaseMessage]) -> AIMessage:
+        if isinstance(messages[-1], ToolMessage):
+            return AIMessage(content=f"Here is what the database says: {str(messages[-1].content)[:200]}")
+        question = str(messages[-1].content)
+        # Every entity named in the question, in order, looked up in a single call as the prompt asks
+        lowered, found = question.lower(), []
+        for name in self.entities:  # Longest names first, so "The Matrix Reloaded" is not read as "The Matrix"
+            position = lowered.find(name.lower())
+            if position >= 0 and not any(name.lower() in other.lower() for _, other in found):
+                found.append((position, name))
+        entities = [name for _, name in sorted(found)] or [question]
+        arguments = json.dumps({"entities": entities, "user_input": question})
+        tool_call = {"id": f"call_{self.calls}", "type": "function", "function": {"name": "Information", "arguments": arguments}}
+        return AIMessage(content="", additional_kwargs={"tool_calls": [tool_call]})
+
+
+def generate_workload(graph: FakeGraph, size: int, seed: int = 0) -> List[str]:
+    """
+    Generate questions over the benchmark graph, mixing fast-path, agent and fallback shapes.
+
+    Parameters:
+        graph (FakeGraph): The graph whose movies and people the questions are about.
+        size (int): The number of questions.
+        seed (int): The seed of the random generator, for reproducible workloads.
+
+    Returns:
+        List[str]: The questions.
+    """
+    rng = random.Random(seed)
+    movies = [node["name"] for node in graph.nodes.values() if node["label"] == "Movie"]
+    people = [node["name"] for node in graph.nodes.values() if node["label"] == "Person"]
+    templates = [
+        lambda: f"Who played in {rng.choice(movies)}?",
+        lambda: f"who played in {rng.choice(movies).lower()}",
+        lambda: f"Tell me more about {rng.choice(movies)}",
+        lambda: f"How many movies has {rng.choice(people)} acted in?",
+        lambda: f"What else has {rng.choice(people)} done?",
+        lambda: "How many actors are there in the graph?",
+        lambda: "How many people are both directors and actors of movies?",
+        lambda: "Compare {} and {}".format(*rng.sample(movies, 2)),
+    ]
+    return [rng.choice(templates)() for _ in range(size)]
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_stage(name: str, operation: Callable[[str], Any], inputs: List[str], llm: FakeChatModel,
+              graph: FakeGraph, allocation_samples: int) -> dict:
+    """
+    Time an operation over the inputs and measure what it costs per call.
+
+    Parameters:
+        name (str): The name of the stage, for progress output.
+        operation (Callable[[str], Any]): The operation run once per input.
+        inputs (List[str]): The inputs of the stage.
+        llm (FakeChatModel): The model stand-in, whose counters are read.
+        graph (FakeGraph): The graph stand-in, whose counters are read.
+        allocation_samples (int): How many inputs to replay under tracemalloc.
+
+    Returns:
+        dict: The latency percentiles, throughput and per-operation costs of the stage.
+    """
+    print(f"Running {name} over {len(inputs)} inputs...", file=sys.stderr)
+    calls, tokens, queries = llm.calls, llm.prompt_tokens, graph.queries
+    latencies = []
+    started = time.perf_counter()
+    for item in inputs:
+        begin = time.perf_counter()
+        operation(item)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    ops = len(inputs)
+    result = {
+        "ops": ops,
+        "p50_ms": 1000 * percentile(latencies, 0.50),
+        "p95_ms": 1000 * percentile(latencies, 0.95),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "throughput_ops": ops / elapsed if elapsed else float("inf"),
+        "prompt_tokens_per_op": (llm.prompt_tokens - tokens) / ops,
+        "llm_calls_per_op": (llm.calls - calls) / ops,
+        "graph_queries_per_op": (graph.queries - queries) / ops,
+    }
+    # Allocations are measured in a separate pass since tracemalloc slows everything down
+    samples = inputs[:allocation_samples]
+    if samples:
+        peaks = []
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for item in samples:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            operation(item)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        result["peak_alloc_kib_per_op"] = sum(peaks) / len(peaks) / 1024
+        result["retained_alloc_kib_per_op"] = retained / len(samples) / 1024
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    List the stages whose p95 latency or prompt tokens regressed against a baseline.
+
+    Parameters:
+        results (dict): The results of this run.
+        baseline (dict): The results of the reference run.
+        tolerance (float): The accepted relative increase, e.g. 0.2 for 20%.
+
+    Returns:
+        List[str]: One description per regression; empty when there is none.
+    """
+    regressions = []
+    for stage, metrics in results.items():
+        reference = baseline.get(stage)
+        if reference is None:
+            continue
+        for metric in ("p95_ms", "prompt_tokens_per_op"):
+            if metrics[metric] > reference[metric] * (1 + tolerance) + 1e-9:
+                regressions.append(f"{stage}.{metric}: {metrics[metric]:.2f} > {reference[metric]:.2f}")
+    return regressions
+
+
+def run_benchmark(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the chatbot pipeline offline.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="milliseconds per model call")
+    parser.add_argument("--graph-latency", type=float, default=0.0, help="milliseconds per graph query")
+    parser.add_argument("--workload", type=int, default=200, help="number of generated questions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allocation-samples", type=int, default=20)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against the results in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--replica", action="store_true", help="serve entity contexts from the local graph replica")
+    parser.add_argument("--answer-cache", action="store_true", help="serve repeated questions from the answer cache")
+    parser.add_argument("--context-store", help="build a context store at this path and serve entity contexts from it")
+    args = parser.parse_args(argv)
+
+    # Keep the benchmark self-contained: no cache files are read or written
+    os.environ["CYPHER_CACHE_PATH"] = ""
+    os.environ["ANSWER_CACHE_PATH"] = ""
+    os.environ["ANSWER_CACHE"] = "1" if args.answer_cache else "0"
+    os.environ["GRAPH_REPLICA_PATH"] = ""
+    os.environ["GRAPH_REPLICA"] = "1" if args.replica else "0"
+    os.environ["CONTEXT_STORE_PATH"] = args.context_store or ""
+    import demos
+    import main as chatbot
+
+    graph = FakeGraph(latency=args.graph_latency / 1000)
+    entities = sorted((node["name"] for node in graph.nodes.values()), key=len, reverse=True)
+    llm = FakeChatModel(latency=args.llm_latency / 1000, entities=entities)
+    chatbot.get_graph.override(graph)
+    chatbot.get_llm.override(llm)
+    if args.context_store:
+        context_store.build_from_graph(graph, args.context_store)
+
+    demo_queries = [query for demo in (demos.demo1, demos.demo2, demos.demo3, demos.demo4)
+                    for query in demo["queries"] if not query.startswith("feedback:")]
+    inputs = demo_queries + generate_workload(graph, args.workload, args.seed)
+    entity_inputs = [name.lower() for name in entities] * max(1, args.workload // len(entities))
+    fallback_inputs = [query for query in inputs if "how many" in query.lower() and "acted" not in query.lower()]
+
+    executor = chatbot.get_agent_executor()
+    stages = {
+        "pipeline": (lambda q: chatbot.respond(q, chatbot.new_chat_history()), inputs),
+        "agent": (lambda q: executor.invoke({"input": q, "chat_history": chatbot.new_chat_history()}), inputs),
+        "get_information": (lambda entity: chatbot.get_information(entity, entity), entity_inputs),
+        "chain": (lambda q: chatbot.get_chain().invoke(q), fallback_inputs),
+        "cached_chain": (lambda q: chatbot.get_cached_chain().invoke(q), fallback_inputs),
+    }
+    results = {name: run_stage(name, operation, stage_inputs, llm, graph, args.allocation_samples)
+               for name, (operation, stage_inputs) in stages.items() if stage_inputs}
+
+    columns = ["ops", "p50_ms", "p95_ms", "p99_ms", "throughput_ops", "prompt_tokens_per_op",
+               "llm_calls_per_op", "graph_queries_per_op", "peak_alloc_kib_per_op"]
+    print(f"{'stage':<16}" + "".join(f"{column:>22}" for column in columns))
+    for name, metrics in results.items():
+        print(f"{name:<16}" + "".join(f"{metrics.get(column, 0):>22.2f}" for column in columns))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_benchmark())
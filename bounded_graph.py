@@ -0,0 +1,226 @@
+"""
+This module bounds the result of the Cypher statements generated by the GraphCypherQAChain
+fallback before they reach the answer prompt. A broad question such as "List all actors" makes
+the chain generate a statement returning thousands of rows; `Neo4jGraph.query` materializes them
+all, and everything kept is pasted into the prompt, so memory, tokens and latency grow with the
+size of the graph.
+
+Key Components:
+- `inject_limit`: Adds a LIMIT to a statement without one, or lowers a larger literal or parameter
+  LIMIT, so the database stops producing rows past the scan budget.
+- BoundedGraph: Wraps the graph handed to the chain. Rows are streamed from the Neo4j driver and
+  kept only while they fit the row and token budgets; the remaining rows up to the scan limit are
+  counted without being kept. Long lists inside a row are cut as well. Like
+  `graph_setup.ResilientNeo4jGraph`, statements time out with the turn's deadline and are retried
+  on transient errors.
+- ResultSummary: The facts about a truncated result, rendered as a note placed before the rows:
+  how many rows were kept out of how many, and the minimum, maximum and sum of numeric columns
+  over every row scanned.
+
+Usage:
+- `main.get_chain` wraps its graph in a BoundedGraph configured by CYPHER_MAX_ROWS,
+  CYPHER_MAX_TOKENS and CYPHER_SCAN_LIMIT; the cached Cypher of `CachedCypherQAChain` runs
+  through the same wrapper.
+"""
+
+
+# Standard library imports
+from typing import Any, Dict, List, Optional
+import re
+
+# Third-party imports
+from langchain_community.graphs.neo4j_graph import value_sanitize
+from neo4j import Query
+from neo4j.exceptions import CypherSyntaxError
+
+# Application-specific imports
+from graph_setup import is_transient
+from graph_wrapper import GraphWrapper
+from history import count_tokens
+import deadline
+
+
+# A trailing LIMIT with a literal count or a parameter (`LIMIT 10`, `LIMIT $k`)
+_TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(?:(?P<count>\d+)|\$(?P<parameter>\w+))\s*$", re.IGNORECASE)
+_RETURN = re.compile(r"\bRETURN\b", re.IGNORECASE)
+# Statements where a trailing LIMIT would not bound the whole result, or would change a write
+_UNBOUNDABLE = re.compile(r"\b(UNION|CREATE|MERGE|DELETE|SET|REMOVE|CALL|FOREACH|LOAD\s+CSV)\b", re.IGNORECASE)
+
+
+def inject_limit(cypher: str, limit: int, params: Optional[dict] = None) -> str:
+    """
+    Bound the number of rows a read statement returns.
+
+    Parameters:
+        cypher (str): The statement.
+        limit (int): The maximum number of rows.
+        params (Optional[dict]): The parameters the statement runs with, to read a `LIMIT $k`.
+
+    Returns:
+        str: The statement ending with `LIMIT <limit>` or a smaller limit of its own. A parameter
+            limit whose value is unknown is capped in the statement itself. Statements without a
+            RETURN clause, writes, procedure calls and unions are returned unchanged.
+    """
+    statement = cypher.strip().rstrip(";").rstrip()
+    if not _RETURN.search(statement) or _UNBOUNDABLE.search(statement):
+        return cypher
+    match = _TRAILING_LIMIT.search(statement)
+    if match is None:
+        return f"{statement}\nLIMIT {limit}"
+    count = match.group("count")
+    if count is None:
+        value = (params or {}).get(match.group("parameter"))
+        if not isinstance(value, int) or isinstance(value, bool):
+            # LIMIT accepts an expression over parameters, so the smaller of the two is chosen at run time
+            parameter = f"${match.group('parameter')}"
+            return (f"{statement[:match.start()]}"
+                    f"LIMIT CASE WHEN {parameter} < {limit} THEN {parameter} ELSE {limit} END")
+        count = value
+    if int(count) <= limit:
+        return statement
+    return f"{statement[:match.start()]}LIMIT {limit}"
+
+
+class ResultSummary():
+    """
+    What is known about a result after its rows were bounded.
+
+    Attributes:
+        kept (int): The number of rows kept.
+        scanned (int): The number of rows read from the database.
+        exhausted (bool): Whether every row of the result was read.
+        numeric (Dict[str, List[float]]): The minimum, maximum and sum of each numeric column.
+        cut_lists (int): The number of lists shortened inside the kept rows.
+    """
+
+    def __init__(self):
+        self.kept = 0
+        self.scanned = 0
+        self.exhausted = True
+        self.numeric: Dict[str, List[float]] = {}
+        self.cut_lists = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.kept < self.scanned or not self.exhausted or self.cut_lists > 0
+
+    def observe(self, row: dict) -> None:
+        """Count a row and fold its numeric values into the column aggregates."""
+        self.scanned += 1
+        for key, value in row.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                aggregate = self.numeric.get(key)
+                if aggregate is None:
+                    self.numeric[key] = [value, value, value]
+                else:
+                    aggregate[0] = min(aggregate[0], value)
+                    aggregate[1] = max(aggregate[1], value)
+                    aggregate[2] += value
+
+    def note(self) -> dict:
+        """
+        Describe the truncation for the answer prompt.
+
+        Returns:
+            dict: A row with a `note` key, and the column aggregates when the result had more rows
+                than were kept.
+        """
+        total = f"{self.scanned}" if self.exhausted else f"at least {self.scanned}"
+        parts = [f"The result was truncated: {self.kept} of {total} rows are shown."]
+        if self.cut_lists:
+            parts.append("Long lists are cut short and end with the number of items left out.")
+        note: Dict[str, Any] = {"note": " ".join(parts)}
+        if self.kept < self.scanned and self.numeric:
+            note["aggregates_over_scanned_rows"] = {
+                key: {"min": low, "max": high, "sum": total_value}
+                for key, (low, high, total_value) in self.numeric.items()
+            }
+        return note
+
+
+class BoundedGraph(GraphWrapper):
+    """
+    A graph wrapper streaming query results and bounding them by rows and tokens.
+
+    Attributes:
+        graph (Neo4jGraph): The wrapped graph.
+        max_rows (int): The maximum number of rows kept.
+        max_tokens (int): The token budget of the rows kept.
+        scan_limit (int): The LIMIT injected into statements; rows past `max_rows` are only
+            counted, up to this limit.
+        max_list_items (int): The maximum number of items kept in a list value.
+    """
+
+    def __init__(self, graph, max_rows: int = 25, max_tokens: int = 2000, scan_limit: int = 1000,
+                 max_list_items: int = 25):
+        super().__init__(graph)
+        self.max_rows = max_rows
+        self.max_tokens = max_tokens
+        self.scan_limit = max(scan_limit, max_rows)
+        self.max_list_items = max_list_items
+
+    def query(self, query: str, params: dict = {}) -> List[Dict[str, Any]]:
+        """
+        Run a statement and return its rows within the budgets. A truncated result starts with a
+        note row describing what was left out.
+
+        Parameters:
+            query (str): The Cypher statement.
+            params (dict): The statement parameters.
+
+        Returns:
+            List[Dict[str, Any]]: The rows kept, preceded by a note when the result was truncated.
+        """
+        query = inject_limit(query, self.scan_limit, params)
+        if getattr(self.graph, "_driver", None) is None:
+            # Graphs without a driver (e.g. test stand-ins) can only be bounded after the fact
+            return self._bound(iter(self.graph.query(query, params)))
+        return deadline.retry(lambda: self._stream(query, params), is_transient,
+                              getattr(self.graph, "max_retries", 0), stage="neo4j")
+
+    def _stream(self, query: str, params: dict) -> List[Dict[str, Any]]:
+        # Fetch in batches of the row budget, so rows past the budget are pulled only to be counted
+        with self.graph._driver.session(database=self.graph._database, fetch_size=self.max_rows + 1) as session:
+            try:
+                result = session.run(Query(text=query, timeout=deadline.timeout(self.graph.timeout, "neo4j")), params)
+                sanitize = self.graph.sanitize
+                # Leaving the session discards whatever the server has not sent yet
+                return self._bound(value_sanitize(record.data()) if sanitize else record.data() for record in result)
+            except CypherSyntaxError as e:
+                raise ValueError(f"Generated Cypher Statement is not valid\n{e}")
+
+    def _bound(self, rows) -> List[Dict[str, Any]]:
+        summary = ResultSummary()
+        kept: List[Dict[str, Any]] = []
+        tokens = 0
+        full = False
+        for row in rows:
+            if row is None:
+                continue
+            summary.observe(row)
+            if not full:
+                row = self._cut_lists(row, summary)
+                row_tokens = count_tokens(str(row))
+                # The first row is always kept, however large, so the question can be answered
+                if kept and (len(kept) >= self.max_rows or tokens + row_tokens > self.max_tokens):
+                    full = True
+                else:
+                    kept.append(row)
+                    tokens += row_tokens
+            if summary.scanned >= self.scan_limit:
+                # The injected LIMIT was reached, so there may have been more rows
+                summary.exhausted = False
+                break
+        summary.kept = len(kept)
+        if summary.truncated:
+            return [summary.note()] + kept
+        return kept
+
+    def _cut_lists(self, row: dict, summary: ResultSummary) -> dict:
+        cut = {}
+        for key, value in row.items():
+            if isinstance(value, list) and len(value) > self.max_list_items:
+                summary.cut_lists += 1
+                value = value[:self.max_list_items] + [f"... and {len(value) - self.max_list_items} more"]
+            cut[key] = value
+        return cut
@@ -0,0 +1,161 @@
+"""
+This module provides a bounded in-memory cache of the context strings built by
+`prompts.description_by_id_query`. Popular entities such as The Matrix or Tom Hanks are asked
+about constantly, and rebuilding their context means a multi-hop aggregation in Neo4j on every
+mention. Entries are invalidated when the graph changes rather than after a blind TTL.
+
+Key Components:
+- GraphVersionProbe: Reads a cheap version stamp of the graph, made of the value of an optional
+  `GraphVersion` counter node plus the node and relationship counts, and rate-limits how often
+  the stamp is read.
+- EntityContextCache: A thread-safe LRU mapping from node id to context string with hit, miss
+  and eviction counters. It clears itself and notifies listeners whenever the probe reports a
+  new graph version.
+
+Usage:
+- `main.get_information` calls `EntityContextCache.check_version` before resolving an entity and
+  then serves the context from the cache when possible. Listeners registered with
+  `add_invalidation_listener` (such as the entity index rebuild) run after a version change, on
+  the thread of the request that noticed it, so they should hand slow work to a background thread.
+"""
+
+
+# Standard library imports
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+import threading
+import time
+
+# Application-specific imports
+import prompts
+
+
+class GraphVersionProbe():
+    """
+    Reads a version stamp of the graph, at most once per interval.
+
+    Attributes:
+        graph (Neo4jGraph): The graph to probe.
+        interval (float): The minimum number of seconds between two probes.
+    """
+
+    def __init__(self, graph, interval: float = 5.0):
+        self.graph = graph
+        self.interval = interval
+        self._version: Optional[Tuple] = None
+        self._checked_at = float("-inf")
+
+    def current(self, force: bool = False) -> Optional[Tuple]:
+        """
+        Return the latest known graph version, probing the graph if the interval has passed.
+
+        Parameters:
+            force (bool): Probe the graph even if the interval has not passed yet.
+
+        Returns:
+            Optional[Tuple]: The version stamp, or the previous one when the probe fails.
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.interval:
+            return self._version
+        self._checked_at = now
+        try:
+            row = self.graph.query(prompts.graph_version_query)[0]
+            self._version = (row["version"], row["nodes"], row["relationships"])
+        except Exception as e:
+            print(f"Graph version probe failed: {e}")
+        return self._version
+
+
+class EntityContextCache():
+    """
+    An LRU cache of entity context strings, invalidated by graph version changes.
+
+    Attributes:
+        probe (GraphVersionProbe): The probe that detects graph changes.
+        maxsize (int): The maximum number of entries kept.
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups not found in the cache.
+        evictions (int): The number of entries dropped to respect `maxsize`.
+    """
+
+    def __init__(self, probe: GraphVersionProbe, maxsize: int = 2048):
+        self.probe = probe
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []
+        self._version = probe.current(force=True)
+
+    def add_invalidation_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Register a callable run (without arguments) every time the graph version changes. It runs
+        on the request thread that noticed the change and should return quickly.
+        """
+        self._listeners.append(listener)
+
+    @property
+    def version(self) -> Optional[Tuple]:
+        """The graph version stamp the cached entries were built from."""
+        return self._version
+
+    def check_version(self) -> bool:
+        """
+        Probe the graph version and clear the cache if it changed.
+
+        Returns:
+            bool: True if the cache was invalidated.
+        """
+        version = self.probe.current()
+        if version == self._version:
+            return False
+        with self._lock:
+            if version == self._version:
+                return False
+            self._version = version
+            self._entries.clear()
+        for listener in self._listeners:
+            listener()
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the cached context for a node, or None on a miss.
+
+        Parameters:
+            key (str): The element id of the node.
+
+        Returns:
+            Optional[str]: The cached context string.
+        """
+        with self._lock:
+            context = self._entries.get(key)
+            if context is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return context
+
+    def put(self, key: str, context: str) -> None:
+        """
+        Cache the context of a node, evicting the least recently used entries if needed.
+
+        Parameters:
+            key (str): The element id of the node.
+            context (str): The context string built for the node.
+        """
+        with self._lock:
+            self._entries[key] = context
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Return the size of the cache and its hit, miss and eviction counters."""
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
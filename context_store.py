@@ -0,0 +1,286 @@
+"""
+This module precomputes the context string of every movie and person into a single file that
+worker processes open with mmap. The aggregation in `prompts.description_query` (collect, reduce
+and substring per relationship type) is otherwise rebuilt on every lookup; here it runs once, in
+an offline build step, and a lookup becomes a binary search over the mapped file.
+
+Key Components:
+- `write_store`: Writes (node id, context) pairs to a store file, replacing the previous file
+  atomically with `os.replace`.
+- `build_from_graph` and `build_from_replica`: Materialize the contexts with
+  `prompts.all_contexts_query`, or from a graph replica export without contacting Neo4j.
+- ContextStore: Opens a store file read-only with mmap and looks contexts up by node id. It
+  notices when the file has been replaced and maps the new one.
+
+File format:
+- A header (magic, format version, entry count and the length of a JSON metadata block holding
+  the graph version stamp the store was built from), the metadata, then a fixed-width index of
+  `(key offset, key length, value offset, value length)` records sorted by key, and finally the
+  UTF-8 keys and contexts.
+
+Functionality:
+- The file is mapped read-only, so its pages live in the operating system's page cache and are
+  shared by every process that opens it: memory use stays flat however many workers are forked.
+  Lookups read the index in place. Each step of the binary search copies out only the short key
+  it compares (a memoryview cannot be ordered), and the context returned is decoded straight from
+  the mapped pages.
+- A store whose graph version stamp differs from the graph's current one is stale; the caller
+  then falls back to Neo4j until the file is rebuilt.
+
+Usage:
+- Build with `python context_store.py build .cache/contexts.store` (or `--replica replica.jsonl`
+  to build from a graph replica export) and set CONTEXT_STORE_PATH to the file. With
+  CONTEXT_STORE_REBUILD=1, a process rebuilds the file in the background when the graph changes;
+  set it on one process only, the others pick the new file up.
+"""
+
+
+# Standard library imports
+from typing import Iterable, NamedTuple, Optional, Tuple
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Application-specific imports
+import prompts
+
+
+MAGIC = b"CTXSTORE"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIII")  # magic, format version, entry count, metadata length
+_ENTRY = struct.Struct("<QIQI")  # key offset, key length, value offset, value length
+
+
+def write_store(path: str, entries: Iterable[Tuple[str, str]], version=None) -> int:
+    """
+    Write a store file, replacing any previous one atomically.
+
+    Parameters:
+        path (str): The store file.
+        entries (Iterable[Tuple[str, str]]): The node ids and their contexts.
+        version (Tuple): The graph version stamp the contexts were built from, if known.
+
+    Returns:
+        int: The number of entries written.
+    """
+    encoded = sorted({key.encode("utf-8"): value.encode("utf-8") for key, value in entries if value}.items())
+    metadata = json.dumps({"version": version, "built_at": time.time()}, default=str).encode("utf-8")
+    data_start = _HEADER.size + len(metadata) + _ENTRY.size * len(encoded)
+    index, blob, offset = bytearray(), bytearray(), data_start
+    for key, value in encoded:
+        index += _ENTRY.pack(offset, len(key), offset + len(key), len(value))
+        blob += key
+        blob += value
+        offset += len(key) + len(value)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(encoded), len(metadata)))
+        f.write(metadata)
+        f.write(index)
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers holding the previous file keep their mapping; new opens see the complete new file
+    os.replace(temporary, path)
+    return len(encoded)
+
+
+def build_from_graph(graph, path: str) -> int:
+    """
+    Materialize the context of every movie and person in the graph into a store file.
+
+    Parameters:
+        graph (Neo4jGraph): The graph to read the contexts from.
+        path (str): The store file.
+
+    Returns:
+        int: The number of entries written.
+    """
+    # Read the version first: changes landing during the build make the store look stale, not fresh
+    row = graph.query(prompts.graph_version_query)[0]
+    version = (row["version"], row["nodes"], row["relationships"])
+    rows = graph.query(prompts.all_contexts_query)
+    return write_store(path, ((row["id"], row["context"]) for row in rows), version)
+
+
+def build_from_replica(replica, path: str) -> int:
+    """
+    Materialize the context of every movie and person of a graph replica into a store file.
+
+    The graph version is unknown, so the store is trusted until it is rebuilt.
+
+    Parameters:
+        replica (GraphReplica): The replica to build the contexts from.
+        path (str): The store file.
+
+    Returns:
+        int: The number of entries written.
+    """
+    return write_store(path, ((row["id"], replica.context(row["id"])) for row in replica.entity_rows()))
+
+
+class _Mapping(NamedTuple):
+    mapping: Optional[mmap.mmap]
+    count: int
+    index_start: int
+    version: Optional[tuple]
+    identity: Optional[tuple]
+
+
+_EMPTY = _Mapping(None, 0, 0, None, None)
+
+
+class ContextStore():
+    """
+    A read-only, memory-mapped store of entity contexts.
+
+    Attributes:
+        path (str): The store file. A missing file behaves as an empty store.
+        check_interval (float): The minimum number of seconds between two checks for a new file.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mapping = _EMPTY
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._reopen_if_changed(force=True)
+
+    @property
+    def version(self) -> Optional[tuple]:
+        """The graph version stamp the store was built from, or None if unknown."""
+        return self._mapping.version
+
+    def is_current(self, version: Optional[tuple]) -> bool:
+        """
+        Whether the store was built from the given graph version.
+
+        Parameters:
+            version (Tuple): The current graph version stamp, or None if it is unknown.
+
+        Returns:
+            bool: False only when both stamps are known and differ.
+        """
+        self._reopen_if_changed()
+        stored = self.version
+        return version is None or stored is None or stored == tuple(version)
+
+    def __len__(self) -> int:
+        return self._mapping.count
+
+    def get(self, node_id: str) -> Optional[str]:
+        """
+        Look up the context of a node.
+
+        Parameters:
+            node_id (str): The element id of the node.
+
+        Returns:
+            Optional[str]: The context, or None when the node is not in the store.
+        """
+        self._reopen_if_changed()
+        current = self._mapping
+        if current.mapping is None:
+            return None
+        key = node_id.encode("utf-8")
+        mapping, low, high = current.mapping, 0, current.count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, value_offset, value_length = _ENTRY.unpack_from(
+                mapping, current.index_start + middle * _ENTRY.size
+            )
+            candidate = mapping[key_offset:key_offset + key_length]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return str(memoryview(mapping)[value_offset:value_offset + value_length], "utf-8")
+        return None
+
+    def rebuild_in_background(self, graph) -> Optional[threading.Thread]:
+        """
+        Rebuild the store file from the graph in a background thread, unless a rebuild is
+        already running. The new file is mapped on the next lookup.
+
+        Parameters:
+            graph (Neo4jGraph): The graph to read the contexts from.
+
+        Returns:
+            Optional[threading.Thread]: The thread running the rebuild, or None if one is running.
+        """
+        if not self._rebuild_lock.acquire(blocking=False):
+            return None
+
+        def run():
+            try:
+                build_from_graph(graph, self.path)
+                self._reopen_if_changed(force=True)
+            except Exception as e:
+                print(f"Failed to rebuild the context store: {e}")
+            finally:
+                self._rebuild_lock.release()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _reopen_if_changed(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._mapping = _EMPTY
+                return
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if identity == self._mapping.identity:
+                return
+            try:
+                self._mapping = _open(self.path, identity)
+            except (OSError, ValueError) as e:
+                print(f"Failed to open the context store {self.path}: {e}")
+            # The previous mapping is closed once no reader references it any more
+
+
+def _open(path: str, identity: tuple) -> _Mapping:
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, format_version, count, metadata_length = _HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        mapping.close()
+        raise ValueError("not a context store of a supported format")
+    metadata = json.loads(mapping[_HEADER.size:_HEADER.size + metadata_length])
+    version = tuple(metadata["version"]) if metadata.get("version") is not None else None
+    return _Mapping(mapping, count, _HEADER.size + metadata_length, version, identity)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the precomputed entity context store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="materialize every entity context into a store file")
+    build.add_argument("path")
+    build.add_argument("--replica", help="build from this graph replica export instead of Neo4j")
+    args = parser.parse_args()
+
+    if args.replica:
+        from graph_replica import GraphReplica
+
+        written = build_from_replica(GraphReplica.from_file(args.replica), args.path)
+    else:
+        from graph_setup import Neo4jCustomGraph
+
+        written = build_from_graph(Neo4jCustomGraph().get_graph_object(), args.path)
+    print(f"Wrote the context of {written} entities to {args.path}")
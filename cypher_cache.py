@@ -0,0 +1,226 @@
+"""
+This module provides a persistent cache of generated Cypher statements for the
+GraphCypherQAChain fallback. Questions that do not name a known entity are handed to the chain,
+which costs one GPT round trip to generate a Cypher statement and another to phrase the answer.
+Most of these questions are asked over and over again, so the Cypher generated for them is
+remembered and simply executed on the next occurrence.
+
+Key Components:
+- `normalize_question`: Folds a natural language question to the key used by the cache.
+- `schema_fingerprint`: Hashes the graph schema so that cached statements are discarded as soon
+  as the schema they were generated against changes.
+- CypherCache: A thread-safe LRU mapping from normalized question to Cypher with a TTL, persisted
+  to a local JSON file so it survives restarts.
+- CachedCypherQAChain: Wraps a GraphCypherQAChain; on a cache hit only the cached Cypher is
+  executed against the graph, on a miss the chain runs and the Cypher it generated is cached.
+
+Usage:
+- `main.get_information` invokes `CachedCypherQAChain.invoke` wherever it previously invoked the
+  GraphCypherQAChain directly.
+"""
+
+
+# Standard library imports
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+# Application-specific imports
+from deadline import DeadlineExceeded
+import metrics
+
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Fold a question to its cache key by lowercasing it and removing punctuation and extra spaces.
+
+    Parameters:
+        question (str): The natural language question.
+
+    Returns:
+        str: The normalized question.
+    """
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", question.lower())).strip()
+
+
+def schema_fingerprint(schema: str) -> str:
+    """
+    Compute a short, stable fingerprint of a graph schema description.
+
+    Parameters:
+        schema (str): The schema as returned by `Neo4jGraph.get_schema`.
+
+    Returns:
+        str: A hex digest identifying the schema.
+    """
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()[:16]
+
+
+class CypherCache():
+    """
+    A size- and age-bounded mapping from normalized question to validated Cypher.
+
+    Attributes:
+        path (Optional[str]): The JSON file the cache is persisted to, or None to keep it in memory.
+        maxsize (int): The maximum number of entries kept; the least recently used is evicted first.
+        ttl (float): The number of seconds after which an entry expires.
+        fingerprint (str): The schema fingerprint the entries were generated against.
+    """
+
+    def __init__(self, path: Optional[str] = None, maxsize: int = 1024, ttl: float = 7 * 24 * 3600,
+                 fingerprint: str = ""):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.fingerprint = fingerprint
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def get(self, question: str) -> Optional[str]:
+        """
+        Return the cached Cypher for a question, or None when it is missing or expired.
+
+        Parameters:
+            question (str): The natural language question.
+
+        Returns:
+            Optional[str]: The cached Cypher statement.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            cypher, created = entry
+            if time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return cypher
+
+    def put(self, question: str, cypher: str) -> None:
+        """
+        Store the Cypher generated for a question and persist the cache.
+
+        Parameters:
+            question (str): The natural language question.
+            cypher (str): The Cypher statement that answered it.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = (cypher, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def discard(self, question: str) -> None:
+        """Remove the entry for a question, e.g. when its cached Cypher stopped working."""
+        with self._lock:
+            if self._entries.pop(normalize_question(question), None) is not None:
+                self._save()
+
+    def set_fingerprint(self, fingerprint: str) -> None:
+        """Switch to a new schema fingerprint, dropping every entry if it differs."""
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self._entries.clear()
+                self._save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable Cypher cache {self.path}: {e}")
+            return
+        # Entries generated against another schema are useless, start afresh. Without an expected
+        # fingerprint the stored one is adopted and checked later by `set_fingerprint`.
+        if self.fingerprint and data.get("fingerprint") != self.fingerprint:
+            return
+        self.fingerprint = data.get("fingerprint", "")
+        now = time.time()
+        for key, cypher, created in data.get("entries", [])[-self.maxsize:]:
+            if now - created <= self.ttl:
+                self._entries[key] = (cypher, created)
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        data = {
+            "fingerprint": self.fingerprint,
+            "entries": [[key, cypher, created] for key, (cypher, created) in self._entries.items()],
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+
+class CachedCypherQAChain():
+    """
+    A GraphCypherQAChain front end that reuses previously generated Cypher.
+
+    The wrapped chain must be created with `return_intermediate_steps=True` so that the generated
+    Cypher can be read back from its output.
+
+    Attributes:
+        chain (GraphCypherQAChain): The chain used on a cache miss.
+        graph (Neo4jGraph): The graph the cached Cypher is executed against on a hit.
+        cache (CypherCache): The question to Cypher cache.
+    """
+
+    def __init__(self, chain, graph, cache: CypherCache):
+        self.chain = chain
+        self.graph = graph
+        self.cache = cache
+        self.cache.set_fingerprint(schema_fingerprint(graph.get_schema))
+
+    def invoke(self, question: str) -> dict:
+        """
+        Answer a question, executing cached Cypher when available.
+
+        Parameters:
+            question (str): The natural language question.
+
+        Returns:
+            dict: The `query` and its `result`; on a hit the result holds the raw rows.
+        """
+        cypher = self.cache.get(question)
+        if cypher is not None:
+            metrics.count("cypher_cache_hit")
+            try:
+                rows = self.graph.query(cypher)[: self.chain.top_k]
+                return {"query": question, "result": rows}
+            except DeadlineExceeded:
+                # The turn ran out of time; the cached statement itself is not at fault
+                raise
+            except Exception as e:
+                print(f"Cached Cypher failed, regenerating it: {e}")
+                self.cache.discard(question)
+        metrics.count("cypher_cache_miss")
+        response = self.chain.invoke(question)
+        steps = response.get("intermediate_steps", [])
+        # Only statements that executed and returned rows are trusted enough to be cached
+        if len(steps) > 1 and steps[0].get("query") and steps[1].get("context"):
+            self.cache.put(question, steps[0]["query"])
+        return {"query": response["query"], "result": response["result"]}
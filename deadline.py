@@ -0,0 +1,187 @@
+"""
+This module gives every chat turn a deadline that all of its calls share. Without one, a single
+stalled OpenAI request or Neo4j query holds a turn indefinitely, and these stragglers dominate
+the p99 latency. The deadline is set once per turn and read by the language model, the graph
+queries, the tool and the Cypher chain through a context variable, so it follows the turn into
+worker threads and tasks without being passed around.
+
+Key Components:
+- `budget`: Opens a deadline for the calls made inside it. Nested budgets can only shorten the
+  deadline, never extend it.
+- `remaining`, `check` and `timeout`: Read the time left, fail fast once it is exhausted and cap a
+  call's own timeout by it.
+- `retry` and `aretry`: Retry a call on transient errors with full-jitter exponential backoff, and
+  give up early instead of sleeping past the deadline.
+- DeadlineExceeded: Raised when the turn has no time left.
+
+Usage:
+- `main.respond`, `main.aget_chat_response` and `main.astream_chat_response` open a budget of
+  CHAT_TURN_DEADLINE seconds; `llm.ResilientChatOpenAI` and `graph_setup.ResilientNeo4jGraph`
+  cap their timeouts by it and retry through `retry`.
+"""
+
+
+# Standard library imports
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional
+import asyncio
+import random
+import time
+
+# Application-specific imports
+import metrics
+
+
+# Not a TimeoutError: the async AgentExecutor turns those into its "Agent stopped" notice
+class DeadlineExceeded(Exception):
+    """The deadline of the current turn has passed."""
+
+
+# Monotonic time by which the current turn must be answered, if any
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+@contextmanager
+def budget(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Give the calls made inside the block at most `seconds` to complete.
+
+    Parameters:
+        seconds (Optional[float]): The time budget; None or a non-positive value adds no deadline.
+    """
+    if seconds is None or seconds <= 0:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            # Generators may be closed from another context than the one that opened the budget
+            pass
+
+
+def remaining() -> Optional[float]:
+    """
+    Return the number of seconds left before the deadline.
+
+    Returns:
+        Optional[float]: The time left, negative once the deadline has passed, or None without one.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check(stage: str = "") -> None:
+    """
+    Fail fast when the deadline has passed.
+
+    Parameters:
+        stage (str): The call about to be made, for the error message.
+
+    Raises:
+        DeadlineExceeded: If no time is left.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.count("deadline_exceeded")
+        raise DeadlineExceeded(f"Deadline exceeded{f' before {stage}' if stage else ''}")
+
+
+def timeout(default: Optional[float], stage: str = "") -> Optional[float]:
+    """
+    Cap a call's timeout by the time left.
+
+    Parameters:
+        default (Optional[float]): The call's own timeout in seconds, or None for none.
+        stage (str): The call about to be made, for the error message.
+
+    Returns:
+        Optional[float]: The smaller of the two, or None when neither is set.
+
+    Raises:
+        DeadlineExceeded: If no time is left.
+    """
+    check(stage)
+    left = remaining()
+    if left is None:
+        return default
+    return left if default is None else min(default, left)
+
+
+def _next_delay(error: Exception, attempt: int, is_transient: Callable[[Exception], bool], retries: int,
+                backoff: float, max_backoff: float, retry_after: Callable[[Exception], Optional[float]],
+                stage: str) -> float:
+    # Raises the error when it must not be retried
+    if not is_transient(error):
+        raise error
+    left = remaining()
+    if left is not None and left <= 0:
+        # A timeout capped by the deadline means the turn ran out of time, not that the service is down
+        metrics.count("deadline_exceeded")
+        raise DeadlineExceeded(f"Deadline exceeded{f' during {stage}' if stage else ''}") from error
+    if attempt == retries:
+        raise error
+    delay = retry_after(error)
+    if delay is None:
+        # Full jitter keeps concurrent turns from retrying in lockstep
+        delay = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+    if left is not None and delay >= left:
+        # The next attempt would start after the deadline
+        raise error
+    metrics.count(f"{stage}_retry" if stage else "retry")
+    return delay
+
+
+def retry(fn: Callable[[], Any], is_transient: Callable[[Exception], bool], retries: int = 2,
+          backoff: float = 0.5, max_backoff: float = 8.0,
+          retry_after: Callable[[Exception], Optional[float]] = lambda e: None, stage: str = "") -> Any:
+    """
+    Call `fn` until it succeeds, retrying transient errors with jittered exponential backoff.
+
+    Parameters:
+        fn (Callable): The call, without arguments.
+        is_transient (Callable): Tells whether an error is worth retrying.
+        retries (int): The maximum number of retries.
+        backoff (float): The upper bound of the first delay, in seconds, doubled on every retry.
+        max_backoff (float): The upper bound of any delay, in seconds.
+        retry_after (Callable): Returns the delay requested by the server for an error, if any.
+        stage (str): The call being made, for metrics and error messages.
+
+    Returns:
+        Any: The result of the call.
+
+    Raises:
+        DeadlineExceeded: If the deadline passed, e.g. because it cut an attempt's timeout short.
+        Exception: The last error, when it is not transient, retries are exhausted or the next
+            attempt would start after the deadline.
+    """
+    for attempt in range(retries + 1):
+        check(stage)
+        try:
+            return fn()
+        except Exception as e:
+            delay = _next_delay(e, attempt, is_transient, retries, backoff, max_backoff, retry_after, stage)
+            time.sleep(delay)
+
+
+async def aretry(fn: Callable[[], Any], is_transient: Callable[[Exception], bool], retries: int = 2,
+                 backoff: float = 0.5, max_backoff: float = 8.0,
+                 retry_after: Callable[[Exception], Optional[float]] = lambda e: None, stage: str = "") -> Any:
+    """
+    Like `retry`, for a call returning an awaitable.
+    """
+    for attempt in range(retries + 1):
+        check(stage)
+        try:
+            return await fn()
+        except Exception as e:
+            delay = _next_delay(e, attempt, is_transient, retries, backoff, max_backoff, retry_after, stage)
+            await asyncio.sleep(delay)
@@ -5,9 +5,13 @@ and integrating user feedback into responses.
 
 The demos section in the README provides further information on how to run this.
 """
-import main
+import argparse
+import asyncio
 import queue
 
+import main
+import streaming
+
 # Predefined demos with various scenarios to showcase chatbot functionalities.
 demo1 = {
         'name': 'simple_demo',
@@ -47,10 +51,11 @@ demo4 = {
 # main.get_chat_response()
 
 
-def run_chat():
+def run_chat(stream=False):
     """
     Initiates a demonstration of chatbot functionalities based on predefined queries.
     Allows the user to select a demo to see different aspects of the chatbot in action.
+    With stream set, each response is printed token by token as it is generated.
     """
     print("****")
     print()
@@ -60,15 +65,19 @@ def run_chat():
     print("****")
     print()
 
-    chat_history = []  # Initializes chat history to store conversation.
+    chat_history = main.new_chat_history()  # Initializes chat history to store conversation.
     demo = input("Enter which demo you'd like to see - demo1, demo2, demo3 or demo4 are the options: ")
     
     selected_demo = {'demo1': demo1, 'demo2': demo2, 'demo3': demo3, 'demo4': demo4}.get(demo, demo1)
-    
+
+    if stream:
+        asyncio.run(stream_demo(selected_demo, chat_history))
+        return
+
     for query in selected_demo['queries']:
         print("query: ", query)
         if query.startswith("feedback:"):
-            chat_history.append(("user", query))
+            chat_history.add_feedback(query)
             continue
         
         # Invoke the chatbot with the current input and chat history to generate a response.
@@ -78,11 +87,27 @@ def run_chat():
         
         print()
         print("Bot:", response["output"])  # Display the bot's response.
-        chat_history.append(("user", query))
-        chat_history.append(("bot", response["output"]))
+        chat_history.add_turn(query, response["output"])
         print()
         print('To provide feedback, enter "feedback"')
         print()
 
+async def stream_demo(selected_demo, chat_history):
+    """
+    Runs the queries of a demo on one event loop, streaming every response.
+    """
+    for query in selected_demo['queries']:
+        print("query: ", query)
+        if query.startswith("feedback:"):
+            chat_history.add_feedback(query)
+            continue
+
+        print()
+        output = await streaming.print_stream(main.astream_chat_response(query, chat_history))
+        chat_history.add_turn(query, output)
+        print()
+
 if __name__ == "__main__":
-    run_chat()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the movie chatbot demos.")
+    parser.add_argument("--stream", action="store_true", help="stream the responses as they are generated")
+    run_chat(stream=parser.parse_args().stream)
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""
+This module provides an in-process index over the Movie and Person nodes of the graph so that
+the entity supplied by the language model can be resolved to a node id locally, instead of
+asking Neo4j to scan every node with a case-sensitive `CONTAINS` predicate.
+
+Key Components:
+- `normalize`: Folds an entity name to a canonical form (lowercase, accents and punctuation
+  removed, leading article dropped) so that "matrix", "The Matrix" and "the matrix!" agree.
+- EntityIndex: Holds the normalized names of all entities together with a sorted key list for
+  prefix lookups and a trigram inverted index for typo-tolerant matching.
+
+Functionality:
+- The index is built once from the graph at startup and rebuilt in the background when the graph
+  changes, while lookups keep using the previous build. Resolution tries, in order, an exact match
+  on the normalized name, a prefix match, a substring match and finally a trigram similarity
+  match, returning the element id of the best node or None when nothing is close enough.
+
+Usage:
+- `main.get_information` resolves the entity with `EntityIndex.resolve` and then fetches the
+  context of that node directly by id with `prompts.description_by_id_query`.
+"""
+
+
+# Standard library imports
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Set
+import threading
+import unicodedata
+
+# Application-specific imports
+from cypher_cache import normalize_question
+from singleflight import CoalescedRun
+import prompts
+
+
+_ARTICLES = ("the ", "a ", "an ")
+
+
+def normalize(text: str) -> str:
+    """
+    Fold an entity name to the canonical form used as an index key.
+
+    Parameters:
+        text (str): The raw entity name, e.g. a movie title or a person's name.
+
+    Returns:
+        str: The lowercase name without accents, punctuation or a leading article.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = normalize_question(text)
+    for article in _ARTICLES:
+        if text.startswith(article) and len(text) > len(article):
+            return text[len(article):]
+    return text
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Split a normalized name into its set of character trigrams, padded at word boundaries.
+
+    Parameters:
+        text (str): A name already passed through `normalize`.
+
+    Returns:
+        Set[str]: The trigrams of the name.
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Snapshot(NamedTuple):
+    ids: List[str]
+    names: List[str]
+    keys: Dict[str, List[int]]
+    sorted_keys: List[str]
+    trigrams: Dict[str, List[int]]
+    trigram_counts: List[int]
+
+
+class EntityIndex():
+    """
+    An in-memory lookup table from normalized entity names to graph node ids.
+
+    Attributes:
+        min_similarity (float): The lowest trigram Jaccard similarity accepted as a fuzzy match.
+    """
+
+    def __init__(self, min_similarity: float = 0.4):
+        self.min_similarity = min_similarity
+        self._snapshot = _Snapshot([], [], {}, [], {}, [])
+        self._refresher = CoalescedRun()
+
+    @classmethod
+    def from_graph(cls, graph, **kwargs) -> "EntityIndex":
+        """
+        Build an index from every Movie and Person node in the graph.
+
+        Parameters:
+            graph (Neo4jGraph): The graph to read the entities from.
+
+        Returns:
+            EntityIndex: The populated index.
+        """
+        index = cls(**kwargs)
+        index.refresh(graph)
+        return index
+
+    def refresh(self, graph) -> None:
+        """
+        Rebuild the index from the current contents of the graph.
+
+        Parameters:
+            graph (Neo4jGraph): The graph to read the entities from.
+        """
+        self.build(graph.query(prompts.entity_index_query))
+
+    def refresh_in_background(self, graph) -> Optional[threading.Thread]:
+        """
+        Rebuild the index from a background thread, so the request that noticed the change is not
+        held up by a whole-graph read. A request made while a rebuild is running makes it run once
+        more when it finishes.
+
+        Parameters:
+            graph (Neo4jGraph): The graph to read the entities from.
+
+        Returns:
+            Optional[threading.Thread]: The thread running the rebuild, or None if one is running.
+        """
+        return self._refresher.start(self._refresh_reporting_errors, graph)
+
+    def _refresh_reporting_errors(self, graph) -> None:
+        try:
+            self.refresh(graph)
+        except Exception as e:
+            print(f"Failed to rebuild the entity index: {e}")
+
+    def build(self, rows: List[dict]) -> None:
+        """
+        Replace the contents of the index with the given entities.
+
+        Parameters:
+            rows (List[dict]): Records with an `id` and a `name` key, as returned by
+                `prompts.entity_index_query`.
+        """
+        ids, names = [], []
+        keys = defaultdict(list)
+        grams = defaultdict(list)
+        counts = []
+        for row in rows:
+            if not row.get("name"):
+                continue
+            position = len(ids)
+            key = normalize(str(row["name"]))
+            ids.append(row["id"])
+            names.append(str(row["name"]))
+            keys[key].append(position)
+            row_grams = trigrams(key)
+            counts.append(len(row_grams))
+            for gram in row_grams:
+                grams[gram].append(position)
+        # Swap everything in at once so concurrent readers never see a half-built index
+        self._snapshot = _Snapshot(ids, names, dict(keys), sorted(keys), dict(grams), counts)
+
+    def __len__(self) -> int:
+        return len(self._snapshot.ids)
+
+    def resolve(self, entity: str, exact: bool = False) -> Optional[str]:
+        """
+        Resolve an entity name to the id of the closest node in the graph.
+
+        Parameters:
+            entity (str): The entity as supplied by the user or the language model.
+            exact (bool): Only accept a node whose normalized name equals the entity's, without
+                prefix, substring or typo-tolerant matching.
+
+        Returns:
+            Optional[str]: The element id of the matching node, or None when nothing matches.
+        """
+        snapshot = self._snapshot
+        position = self._lookup(snapshot, normalize(entity or ""), exact)
+        return None if position is None else snapshot.ids[position]
+
+    def name_of(self, entity: str, exact: bool = False) -> Optional[str]:
+        """
+        Return the canonical graph name (title or name property) for an entity.
+
+        Parameters:
+            entity (str): The entity as supplied by the user or the language model.
+            exact (bool): Only accept an exact match of the normalized name, as in `resolve`.
+
+        Returns:
+            Optional[str]: The name stored in the graph, or None when nothing matches.
+        """
+        snapshot = self._snapshot
+        position = self._lookup(snapshot, normalize(entity or ""), exact)
+        return None if position is None else snapshot.names[position]
+
+    def _lookup(self, snapshot: "_Snapshot", key: str, exact: bool = False) -> Optional[int]:
+        if not key:
+            return None
+        keys, sorted_keys = snapshot.keys, snapshot.sorted_keys
+        if key in keys:
+            return keys[key][0]
+        if exact:
+            return None
+        # Prefix match, e.g. "sleepless" -> "sleepless in seattle"; prefer the shortest name
+        candidates = []
+        position = bisect_left(sorted_keys, key)
+        while position < len(sorted_keys) and sorted_keys[position].startswith(key):
+            candidates.append(sorted_keys[position])
+            position += 1
+        if not candidates:
+            # Substring match keeps the behaviour of the former CONTAINS predicate
+            candidates = self._substring_candidates(snapshot, key)
+        if candidates:
+            return keys[min(candidates, key=len)][0]
+        return self._fuzzy_lookup(snapshot, key)
+
+    def _substring_candidates(self, snapshot: "_Snapshot", key: str) -> List[str]:
+        # A name containing the key contains each of its trigrams, so only the names sharing the
+        # rarest one are checked; keys too short to have a trigram fall back to a full scan
+        grams = {key[i:i + 3] for i in range(len(key) - 2)}
+        if not grams:
+            return [candidate for candidate in snapshot.sorted_keys if key in candidate]
+        positions = min((snapshot.trigrams.get(gram, []) for gram in grams), key=len)
+        names = {normalize(snapshot.names[position]) for position in positions}
+        return [name for name in names if key in name]
+
+    def _fuzzy_lookup(self, snapshot: "_Snapshot", key: str) -> Optional[int]:
+        query = trigrams(key)
+        overlap = defaultdict(int)
+        for gram in query:
+            for position in snapshot.trigrams.get(gram, ()):
+                overlap[position] += 1
+        best, best_score = None, self.min_similarity
+        for position, shared in overlap.items():
+            score = shared / (len(query) + snapshot.trigram_counts[position] - shared)
+            if score >= best_score:
+                best, best_score = position, score
+        return best
@@ -0,0 +1,155 @@
+"""
+This module selects the few-shot examples placed in the Cypher-generation prompt. Instead of
+embedding every question/Cypher pair in every prompt, only the examples most similar to the
+user's question are included, so the example store can grow to thousands of pairs without the
+prompt (and its latency) growing with it.
+
+Key Components:
+- `load_examples`: Reads question/Cypher pairs from a JSON lines file and escapes them for use in
+  a prompt template.
+- NgramExampleSelector: A LangChain example selector backed by a local, vectorized TF-IDF index
+  over hashed character n-grams of the example questions. No embedding service is involved.
+
+Functionality:
+- Each question is hashed into a fixed-width vector of character n-gram counts, so adding an
+  example only appends a row to the matrix and updates the document frequencies; nothing is
+  rebuilt, and the weighted row norms are refreshed in a single vectorized pass on the next
+  selection. Similarity is the cosine between IDF-weighted vectors, computed with NumPy for all
+  examples at once.
+
+Usage:
+- `main.few_shot_prompt` uses the selector through `FewShotPromptTemplate(example_selector=...)`.
+  Set EXAMPLES_PATH to a JSON lines file of `{"question": ..., "query": ...}` records to extend
+  the built-in examples, and FEW_SHOT_K to change the number of examples per prompt.
+"""
+
+
+# Standard library imports
+from typing import Dict, Iterable, List, Tuple
+import json
+import threading
+import zlib
+
+# Third-party imports
+from langchain_core.example_selectors import BaseExampleSelector
+import numpy as np
+
+# Application-specific imports
+from cypher_cache import normalize_question
+
+
+def load_examples(path: str) -> List[Dict[str, str]]:
+    """
+    Load question/Cypher examples from a JSON lines file.
+
+    Braces in the Cypher are doubled, as in `prompts.examples`, since the examples end up in a
+    prompt template.
+
+    Parameters:
+        path (str): The file to read, one `{"question": ..., "query": ...}` object per line.
+
+    Returns:
+        List[Dict[str, str]]: The examples, ready to be added to a selector.
+    """
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            examples.append({
+                key: record[key].replace("{", "{{").replace("}", "}}") for key in ("question", "query")
+            })
+    return examples
+
+
+class NgramExampleSelector(BaseExampleSelector):
+    """
+    Selects the k examples whose questions are most similar to the input question.
+
+    Attributes:
+        k (int): The number of examples to select.
+        n_features (int): The width of the hashed feature space.
+        ngram_range (Tuple[int, int]): The smallest and largest character n-gram sizes.
+    """
+
+    def __init__(self, examples: Iterable[Dict[str, str]] = (), k: int = 5, n_features: int = 2 ** 11,
+                 ngram_range: Tuple[int, int] = (2, 4)):
+        self.k = k
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.examples: List[Dict[str, str]] = []
+        self._matrix = np.zeros((16, n_features), dtype=np.float32)
+        self._document_frequency = np.zeros(n_features, dtype=np.float32)
+        # IDF weights and weighted row norms, recomputed lazily after examples are added
+        self._weights = None
+        self._norms = None
+        self._lock = threading.Lock()
+        self.add_examples(examples)
+
+    def add_example(self, example: Dict[str, str]) -> None:
+        """Add a single example to the store."""
+        self.add_examples([example])
+
+    def add_examples(self, examples: Iterable[Dict[str, str]]) -> None:
+        """
+        Add examples to the store, growing the index in place.
+
+        Parameters:
+            examples (Iterable[Dict[str, str]]): Examples with a `question` and a `query` key.
+        """
+        examples = list(examples)
+        if not examples:
+            return
+        rows = np.stack([self._vectorize(example["question"]) for example in examples])
+        with self._lock:
+            start, end = len(self.examples), len(self.examples) + len(rows)
+            if end > len(self._matrix):
+                self._grow(end)
+            self._matrix[start:end] = rows
+            self._document_frequency += (rows > 0).sum(axis=0)
+            self.examples.extend(examples)
+            self._weights = self._norms = None
+
+    def select_examples(self, input_variables: Dict[str, str]) -> List[dict]:
+        """
+        Select the examples most similar to the question in the input variables.
+
+        Parameters:
+            input_variables (Dict[str, str]): The prompt variables, including `question`.
+
+        Returns:
+            List[dict]: Up to k examples, the most similar first.
+        """
+        query = self._vectorize(input_variables["question"])
+        with self._lock:
+            count = len(self.examples)
+            if count == 0:
+                return []
+            matrix = self._matrix[:count]
+            if self._weights is None:
+                idf = np.log((1.0 + count) / (1.0 + self._document_frequency)) + 1.0
+                self._weights = idf * idf
+                self._norms = np.sqrt(np.einsum("ij,ij,j->i", matrix, matrix, self._weights))
+            weights = self._weights
+            # cosine(q * idf, x * idf) for every stored row x, without materializing x * idf
+            norms = self._norms * np.sqrt((query * query) @ weights)
+            scores = (matrix @ (query * weights)) / np.maximum(norms, 1e-9)
+            k = min(self.k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            return [self.examples[i] for i in top[np.argsort(-scores[top])]]
+
+    def _vectorize(self, text: str) -> np.ndarray:
+        text = f" {normalize_question(text)} "
+        counts = np.zeros(self.n_features, dtype=np.float32)
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                counts[zlib.crc32(text[i:i + n].encode("utf-8")) % self.n_features] += 1
+        return np.log1p(counts)
+
+    def _grow(self, size: int) -> None:
+        capacity = max(size, 2 * len(self._matrix))
+        grown = np.zeros((capacity, self.n_features), dtype=np.float32)
+        grown[:len(self.examples)] = self._matrix[:len(self.examples)]
+        self._matrix = grown
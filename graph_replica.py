@@ -0,0 +1,407 @@
+"""
+This module keeps a compact, read-only copy of the movie graph in memory so that the context of
+an entity is built locally instead of with a `description_query` round trip to Neo4j. The graph
+(Movie and Person nodes with ACTED_IN, WROTE, DIRECTED, REVIEWED, PRODUCED and FOLLOWS
+relationships) is small and changes rarely, so holding all of it costs a few megabytes at most.
+
+Key Components:
+- GraphReplica: Loads the graph from Neo4j or from an export file, stores it in arrays and
+  builds entity contexts from it. It is refreshed incrementally from Neo4j when the graph changes.
+
+Functionality:
+- Strings (labels, titles, names, years and relationship types) are interned in one table and
+  nodes refer to them by position, so repeated values are stored once. Relationships are kept
+  as compressed sparse rows: for node i, its neighbours and the types of the relationships to
+  them are `neighbours[offsets[i]:offsets[i + 1]]` and `neighbour_types[offsets[i]:offsets[i + 1]]`,
+  both directions included since `context_projection` matches relationships undirected.
+- `context` returns the same string as `prompts.description_by_id_query`. Relationship types and
+  names appear in the order the relationships were loaded, as Neo4j does not guarantee an order
+  either.
+- `refresh` pulls only the nodes whose `updatedAt` property is greater than the largest one seen
+  so far, together with their relationships, and rebuilds the adjacency in memory. If the node or
+  relationship counts in Neo4j then disagree with the replica (e.g. after a deletion, or a change
+  that did not set `updatedAt`), it reloads everything. Without any `updatedAt` property every
+  refresh is a full reload. The new state is swapped in at once, so readers keep being served from
+  the previous one while Neo4j is queried. A refresh requested while another is running is not
+  dropped: the running one pulls the changes once more before it finishes.
+
+Usage:
+- Set GRAPH_REPLICA=1 to load the replica from Neo4j at startup, or GRAPH_REPLICA_PATH to load
+  it from a file written by `python graph_replica.py export <path>`. `main.get_entity_context`
+  then serves contexts from the replica, and the replica is refreshed in the background whenever
+  the graph version probe reports a change.
+"""
+
+
+# Standard library imports
+from array import array
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import argparse
+import json
+import os
+import threading
+
+# Application-specific imports
+from singleflight import CoalescedRun
+import prompts
+
+
+# Labels a node must have to be described, as in `context_projection`
+ENTITY_LABELS = ("Movie", "Person")
+
+
+class _Node(NamedTuple):
+    id: str
+    labels: List[str]
+    title: Optional[str]
+    name: Optional[str]
+    released: object
+    updated: object
+
+
+class _Snapshot(NamedTuple):
+    strings: List[str]
+    label_sets: List[Tuple[str, ...]]
+    ids: List[str]
+    positions: Dict[str, int]
+    labels: array  # Position of each node's labels in label_sets
+    titles: array  # String position of coalesce(title, name), -1 when missing
+    names: array  # String position of coalesce(name, title), -1 when missing
+    released: array  # String position of the release year, or of "" when missing
+    entities: bytearray  # 1 for Movie and Person nodes
+    updated: List[object]
+    relationship_ids: List[str]
+    sources: array
+    types: array  # String position of each relationship's type
+    targets: array
+    offsets: array
+    neighbours: array
+    neighbour_types: array
+
+
+class GraphReplica():
+    """
+    An in-memory, array-backed copy of the movie graph.
+
+    Attributes:
+        watermark (object): The largest `updatedAt` value loaded, or None if no node has one.
+    """
+
+    def __init__(self):
+        self._snapshot = _build([], [])
+        self.watermark = None
+        self._refresher = CoalescedRun()
+        self._listeners: List[Callable[[], None]] = []
+
+    @classmethod
+    def from_graph(cls, graph) -> "GraphReplica":
+        """
+        Load a replica of every node and context relationship from Neo4j.
+
+        Parameters:
+            graph (Neo4jGraph): The graph to copy.
+
+        Returns:
+            GraphReplica: The loaded replica.
+        """
+        replica = cls()
+        replica.load(graph)
+        return replica
+
+    @classmethod
+    def from_file(cls, path: str) -> "GraphReplica":
+        """
+        Load a replica from an export file written by `save`.
+
+        The file holds one JSON object per line, nodes and relationships in the shape of APOC's
+        JSON export: `{"type": "node", "id", "labels", "properties"}` and
+        `{"type": "relationship", "id", "label", "start": {"id"}, "end": {"id"}}`. Node ids must
+        be element ids, as the fast-path queries look nodes up by them.
+
+        Parameters:
+            path (str): The export file.
+
+        Returns:
+            GraphReplica: The loaded replica.
+        """
+        nodes, relationships = [], []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["type"] == "node":
+                    properties = record.get("properties", {})
+                    nodes.append(_Node(record["id"], record.get("labels", []), properties.get("title"),
+                                       properties.get("name"), properties.get("released"),
+                                       properties.get("updatedAt")))
+                elif record["type"] == "relationship":
+                    relationships.append((record["id"], record["start"]["id"], record["label"], record["end"]["id"]))
+        replica = cls()
+        replica._swap(nodes, relationships)
+        return replica
+
+    def save(self, path: str) -> None:
+        """
+        Write the replica to an export file readable by `from_file`, replacing it atomically.
+
+        Parameters:
+            path (str): The export file.
+        """
+        snapshot = self._snapshot
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            for node in _nodes(snapshot):
+                properties = {key: value for key, value in (("title", node.title), ("name", node.name),
+                              ("released", node.released), ("updatedAt", node.updated)) if value is not None}
+                f.write(json.dumps({"type": "node", "id": node.id, "labels": node.labels,
+                                    "properties": properties}) + "\n")
+            for relationship_id, source, type_, target in _relationships(snapshot):
+                f.write(json.dumps({"type": "relationship", "id": relationship_id, "label": type_,
+                                    "start": {"id": source}, "end": {"id": target}}) + "\n")
+        os.replace(temporary, path)
+
+    def add_refresh_listener(self, listener: Callable[[], None]) -> None:
+        """Register a callable run after every refresh, e.g. to rebuild the entity index."""
+        self._listeners.append(listener)
+
+    def load(self, graph) -> None:
+        """
+        Replace the replica with a full copy of the graph.
+
+        Parameters:
+            graph (Neo4jGraph): The graph to copy.
+        """
+        nodes = [_node_from_row(row) for row in graph.query(prompts.replica_nodes_query, params={"since": None})]
+        relationships = [(row["id"], row["source"], row["type"], row["target"])
+                         for row in graph.query(prompts.replica_relationships_query)]
+        self._swap(nodes, relationships)
+
+    def refresh(self, graph) -> bool:
+        """
+        Bring the replica up to date, pulling only the nodes changed since the last refresh when
+        possible. A call made while a refresh is running returns at once, and the running refresh
+        pulls the changes once more after its current pass, so no change is missed.
+
+        Parameters:
+            graph (Neo4jGraph): The graph to read the changes from.
+
+        Returns:
+            bool: Whether this call refreshed the replica, rather than the refresh already running.
+        """
+        return self._refresher.run(self._refresh, graph)
+
+    def _refresh(self, graph) -> None:
+        self._pull(graph)
+        for listener in self._listeners:
+            listener()
+
+    def refresh_in_background(self, graph) -> threading.Thread:
+        """
+        Refresh the replica from a background thread, so callers keep being served meanwhile.
+
+        Parameters:
+            graph (Neo4jGraph or Callable[[], Neo4jGraph]): The graph to read the changes from, or
+                a getter connecting to it, so that connecting does not block the caller either.
+
+        Returns:
+            threading.Thread: The thread running the refresh.
+        """
+        def run():
+            try:
+                self.refresh(graph() if callable(graph) else graph)
+            except Exception as e:
+                print(f"Failed to refresh the graph replica: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def counts(self) -> Tuple[int, int]:
+        """The number of nodes and relationships in the replica."""
+        snapshot = self._snapshot
+        return len(snapshot.ids), len(snapshot.relationship_ids)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._snapshot.positions
+
+    def entity_rows(self) -> List[dict]:
+        """
+        List the movies and people in the replica, as `prompts.entity_index_query` does.
+
+        Returns:
+            List[dict]: Records with the `id`, `label` and `name` of each entity.
+        """
+        snapshot = self._snapshot
+        strings = snapshot.strings
+        return [{"id": snapshot.ids[i], "label": _first_label(snapshot, i),
+                 "name": strings[snapshot.titles[i]] if snapshot.titles[i] >= 0 else None}
+                for i in range(len(snapshot.ids)) if snapshot.entities[i]]
+
+    def context(self, node_id: str) -> Optional[str]:
+        """
+        Build the context of a node, as `prompts.description_by_id_query` does.
+
+        Parameters:
+            node_id (str): The element id of the node.
+
+        Returns:
+            Optional[str]: The context, or None when the query would return no row, i.e. for
+                nodes that are neither movies nor people or have no context relationships.
+
+        Raises:
+            KeyError: If the node is not in the replica.
+        """
+        snapshot = self._snapshot
+        i = snapshot.positions[node_id]
+        start, end = snapshot.offsets[i], snapshot.offsets[i + 1]
+        if not snapshot.entities[i] or start == end or snapshot.titles[i] < 0:
+            return None
+        strings = snapshot.strings
+        groups: Dict[int, List[str]] = {}
+        for neighbour, type_ in zip(snapshot.neighbours[start:end], snapshot.neighbour_types[start:end]):
+            names = groups.setdefault(type_, [])
+            name = snapshot.names[neighbour]
+            if name >= 0:
+                names.append(strings[name])
+        lines = "".join(f"{strings[type_]}: {', '.join(names)}\n" if names else f"{strings[type_]}\n"
+                        for type_, names in groups.items())
+        return (f"type:{_first_label(snapshot, i)}\ntitle: {strings[snapshot.titles[i]]}\n"
+                f"year: {strings[snapshot.released[i]]}\n{lines}")
+
+    def _pull(self, graph) -> None:
+        if self.watermark is None:
+            self.load(graph)
+            return
+        changed = [_node_from_row(row) for row in
+                   graph.query(prompts.replica_nodes_query, params={"since": self.watermark})]
+        if changed:
+            relationships = graph.query(prompts.replica_changed_relationships_query,
+                                        params={"ids": [node.id for node in changed]})
+            self._apply(changed, [(row["id"], row["source"], row["type"], row["target"])
+                                  for row in relationships])
+        counts = graph.query(prompts.replica_counts_query)[0]
+        if (counts["nodes"], counts["relationships"]) != self.counts():
+            # Deletions and changes without `updatedAt` cannot be pulled incrementally
+            self.load(graph)
+
+    def _swap(self, nodes: List[_Node], relationships: List[tuple]) -> None:
+        snapshot = _build(nodes, relationships)
+        self._snapshot = snapshot
+        self.watermark = max((value for value in snapshot.updated if value is not None), default=None)
+
+    def _apply(self, changed: List[_Node], relationships: List[tuple]) -> None:
+        snapshot = self._snapshot
+        changed_ids = {node.id for node in changed}
+        nodes = [node for node in _nodes(snapshot) if node.id not in changed_ids] + changed
+        # The relationships of changed nodes were all pulled again, so drop the old ones first
+        kept = [relationship for relationship in _relationships(snapshot)
+                if relationship[1] not in changed_ids and relationship[3] not in changed_ids]
+        self._swap(nodes, kept + relationships)
+
+
+def _node_from_row(row: dict) -> _Node:
+    return _Node(row["id"], row["labels"], row["title"], row["name"], row["released"], row["updated"])
+
+
+def _first_label(snapshot: _Snapshot, i: int) -> str:
+    labels = snapshot.label_sets[snapshot.labels[i]]
+    return labels[0] if labels else ""
+
+
+def _nodes(snapshot: _Snapshot) -> Iterable[_Node]:
+    strings = snapshot.strings
+    for i, node_id in enumerate(snapshot.ids):
+        title = strings[snapshot.titles[i]] if snapshot.titles[i] >= 0 else None
+        name = strings[snapshot.names[i]] if snapshot.names[i] >= 0 else None
+        yield _Node(node_id, list(snapshot.label_sets[snapshot.labels[i]]), title, name,
+                    strings[snapshot.released[i]] or None, snapshot.updated[i])
+
+
+def _relationships(snapshot: _Snapshot) -> Iterable[tuple]:
+    strings, ids = snapshot.strings, snapshot.ids
+    for relationship_id, source, type_, target in zip(snapshot.relationship_ids, snapshot.sources,
+                                                       snapshot.types, snapshot.targets):
+        yield relationship_id, ids[source], strings[type_], ids[target]
+
+
+def _build(nodes: List[_Node], relationships: List[tuple]) -> _Snapshot:
+    strings: List[str] = []
+    interned: Dict[str, int] = {}
+
+    def intern(value) -> int:
+        if value is None:
+            return -1
+        value = str(value)
+        position = interned.get(value)
+        if position is None:
+            position = interned[value] = len(strings)
+            strings.append(value)
+        return position
+
+    intern("")
+    label_sets: List[Tuple[str, ...]] = []
+    interned_label_sets: Dict[Tuple[str, ...], int] = {}
+    ids, positions, updated = [], {}, []
+    labels, titles, names, released = array("l"), array("l"), array("l"), array("l")
+    entities = bytearray()
+    for node in nodes:
+        if node.id in positions:
+            continue
+        positions[node.id] = len(ids)
+        ids.append(node.id)
+        label_set = tuple(node.labels)
+        if label_set not in interned_label_sets:
+            interned_label_sets[label_set] = len(label_sets)
+            label_sets.append(label_set)
+        labels.append(interned_label_sets[label_set])
+        # coalesce(m.title, m.name) for the described node, coalesce(t.name, t.title) for its neighbours
+        titles.append(intern(node.title if node.title is not None else node.name))
+        names.append(intern(node.name if node.name is not None else node.title))
+        released.append(intern("" if node.released is None else node.released))
+        entities.append(any(label in ENTITY_LABELS for label in node.labels))
+        updated.append(node.updated)
+
+    relationship_ids, seen = [], set()
+    sources, types, targets = array("l"), array("l"), array("l")
+    degrees = [0] * (len(ids) + 1)
+    for relationship_id, source, type_, target in relationships:
+        if relationship_id in seen or source not in positions or target not in positions:
+            continue
+        seen.add(relationship_id)
+        relationship_ids.append(relationship_id)
+        sources.append(positions[source])
+        types.append(intern(type_))
+        targets.append(positions[target])
+        degrees[positions[source] + 1] += 1
+        degrees[positions[target] + 1] += 1
+
+    offsets = array("l", degrees)
+    for i in range(1, len(offsets)):
+        offsets[i] += offsets[i - 1]
+    neighbours = array("l", [0]) * offsets[-1]
+    neighbour_types = array("l", [0]) * offsets[-1]
+    cursor = array("l", offsets[:-1])
+    for source, type_, target in zip(sources, types, targets):
+        for node, other in ((source, target), (target, source)):
+            neighbours[cursor[node]] = other
+            neighbour_types[cursor[node]] = type_
+            cursor[node] += 1
+
+    return _Snapshot(strings, label_sets, ids, positions, labels, titles, names, released, entities, updated,
+                     relationship_ids, sources, types, targets, offsets, neighbours, neighbour_types)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local replica of the movie graph.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="copy the graph from Neo4j into an export file")
+    export.add_argument("path")
+    args = parser.parse_args()
+
+    from graph_setup import Neo4jCustomGraph
+
+    replica = GraphReplica.from_graph(Neo4jCustomGraph().get_graph_object())
+    replica.save(args.path)
+    nodes, relationships = replica.counts()
+    print(f"Exported {nodes} nodes and {relationships} relationships to {args.path}")
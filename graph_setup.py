@@ -5,9 +5,11 @@ The module uses environment variables to securely configure the database connect
 
 Key Components:
 - Neo4jCustomGraph: A class that encapsulates the logic required to connect to and interact with a Neo4j graph database. It handles connection errors gracefully and provides a method to retrieve the graph object for further operations.
+- ResilientNeo4jGraph: A Neo4jGraph whose queries are bounded by a transaction timeout and by the deadline of the current turn, and retried with jittered backoff on transient errors (lost connections, leader switches, deadlocks).
+- Schema snapshot: The introspected schema is persisted to a local snapshot file (SCHEMA_SNAPSHOT_PATH). A fresh enough snapshot is reused instead of introspecting the schema on connect, and is refreshed in a background thread once it is older than SCHEMA_SNAPSHOT_REFRESH seconds.
 
 Functionality:
-- The module reads database connection details from environment variables, establishes a connection to a Neo4j database, and provides a method to access the connected graph instance. This setup is intended for use in applications that require graph database interactions, particularly those dealing with complex data relationships and queries.
+- The module reads database connection details from environment variables, establishes a connection to a Neo4j database (retrying while the database is unavailable), and provides a method to access the connected graph instance. The driver's connection pool is sized and health-checked according to NEO4J_POOL_SIZE, NEO4J_ACQUISITION_TIMEOUT, NEO4J_CONNECT_TIMEOUT, NEO4J_LIVENESS_CHECK and NEO4J_MAX_CONNECTION_LIFETIME; queries time out after NEO4J_QUERY_TIMEOUT seconds and are retried NEO4J_MAX_RETRIES times. This setup is intended for use in applications that require graph database interactions, particularly those dealing with complex data relationships and queries.
 
 Usage:
 - This module is designed to be imported and utilized by other parts of an application that require direct interactions with a Neo4j database, offering a simplified and centralized way to manage such interactions.
@@ -15,22 +17,151 @@ Usage:
 
 # Standard library imports
 from dotenv import load_dotenv
+from typing import Any, Callable, Dict, List, Optional
+import json
 import os
+import threading
+import time
 
 # Third-party imports
 from langchain_community.graphs import Neo4jGraph
+from langchain_community.graphs.neo4j_graph import value_sanitize
+from neo4j import Query
+from neo4j.exceptions import CypherSyntaxError, DriverError, Neo4jError
+
+# Application-specific imports
+import deadline
 
 load_dotenv()
 
+def is_transient(error: Exception) -> bool:
+    """Whether a Neo4j error is worth retrying, as classified by the driver."""
+    return isinstance(error, (Neo4jError, DriverError)) and error.is_retryable()
+
+def driver_config() -> dict:
+    """The Neo4j driver settings: pool size, connection timeouts and connection health checks."""
+    return {
+        "max_connection_pool_size": int(os.getenv('NEO4J_POOL_SIZE', '50')),
+        "connection_acquisition_timeout": float(os.getenv('NEO4J_ACQUISITION_TIMEOUT', '10')),
+        "connection_timeout": float(os.getenv('NEO4J_CONNECT_TIMEOUT', '5')),
+        # Connections idle for longer are pinged before use, so a dead one is replaced instead of failing a query
+        "liveness_check_timeout": float(os.getenv('NEO4J_LIVENESS_CHECK', '30')),
+        "max_connection_lifetime": float(os.getenv('NEO4J_MAX_CONNECTION_LIFETIME', '3600')),
+        "keep_alive": True,
+    }
+
+class ResilientNeo4jGraph(Neo4jGraph):
+    """
+    A Neo4jGraph with deadline-bounded query timeouts and retries of transient errors.
+
+    The chatbot only reads from the graph, so a query interrupted by a transient error can safely
+    be run again.
+
+    Attributes:
+        max_retries (int): Retries of a query that failed with a transient error.
+    """
+
+    def __init__(self, *args, max_retries: int = 2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retries = max_retries
+
+    def query(self, query: str, params: dict = {}) -> List[Dict[str, Any]]:
+        """Query Neo4j database."""
+        return deadline.retry(lambda: self._query(query, params), is_transient, self.max_retries, stage="neo4j")
+
+    def _query(self, query: str, params: dict) -> List[Dict[str, Any]]:
+        with self._driver.session(database=self._database) as session:
+            try:
+                data = session.run(Query(text=query, timeout=deadline.timeout(self.timeout, "neo4j")), params)
+                json_data = [r.data() for r in data]
+                if self.sanitize:
+                    json_data = [value_sanitize(el) for el in json_data]
+                return json_data
+            except CypherSyntaxError as e:
+                raise ValueError(f"Generated Cypher Statement is not valid\n{e}")
+
 class Neo4jCustomGraph():
-    def __init__(self):
+    def __init__(self, snapshot_path: Optional[str] = None):
         url = os.getenv('NEO4J_URL')
         username = os.getenv('NEO4J_USERNAME')
         password = os.getenv('NEO4J_PASSWORD')
+        self.graph = None
+        self.error = None
+        self._url = url
+        self._snapshot_path = snapshot_path or os.getenv('SCHEMA_SNAPSHOT_PATH', '.cache/schema_snapshot.json')
+        self._snapshot_ttl = float(os.getenv('SCHEMA_SNAPSHOT_TTL', str(24 * 3600)))
+        self._snapshot_refresh = float(os.getenv('SCHEMA_SNAPSHOT_REFRESH', '600'))
+        self._schema_listeners: List[Callable[[], None]] = []
         try:
-            self.graph = Neo4jGraph(url=url, username=username, password=password)
+            snapshot = self._load_snapshot()
+            # Introspecting the schema is the slow part of connecting, skip it when a snapshot is usable
+            self.graph = deadline.retry(
+                lambda: ResilientNeo4jGraph(url=url, username=username, password=password,
+                                            timeout=float(os.getenv('NEO4J_QUERY_TIMEOUT', '10')),
+                                            refresh_schema=snapshot is None, driver_config=driver_config(),
+                                            max_retries=int(os.getenv('NEO4J_MAX_RETRIES', '2'))),
+                # Neo4jGraph reports an unreachable database as a ValueError caused by the driver error
+                lambda e: is_transient(e) or is_transient(e.__context__),
+                int(os.getenv('NEO4J_CONNECT_RETRIES', '3')), backoff=1.0, stage="neo4j_connect",
+            )
+            if snapshot is None:
+                self._save_snapshot()
+            else:
+                self.graph.schema = snapshot["schema"]
+                self.graph.structured_schema = snapshot["structured_schema"]
+                if time.time() - snapshot["created"] > self._snapshot_refresh:
+                    threading.Thread(target=self.refresh_schema, daemon=True).start()
         except Exception as e:
+            self.error = e
             print(f"Failed to connect to Neo4j: {e}")
 
     def get_graph_object(self):
+        if self.graph is None:
+            raise ConnectionError(f"Not connected to Neo4j: {self.error}") from self.error
         return self.graph
+
+    def add_schema_listener(self, listener: Callable[[], None]) -> None:
+        """Register a callable run (without arguments) when a refresh finds a different schema."""
+        self._schema_listeners.append(listener)
+
+    def refresh_schema(self) -> None:
+        """Introspect the schema again, update the snapshot and notify listeners if it changed."""
+        try:
+            previous = self.graph.schema
+            self.graph.refresh_schema()
+            self._save_snapshot()
+        except Exception as e:
+            print(f"Failed to refresh the Neo4j schema: {e}")
+            return
+        if self.graph.schema != previous:
+            for listener in self._schema_listeners:
+                listener()
+
+    def _load_snapshot(self) -> Optional[dict]:
+        try:
+            with open(self._snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # A snapshot is only valid for the database it was taken from, and only for a while
+        if snapshot.get("url") != self._url or time.time() - snapshot.get("created", 0) > self._snapshot_ttl:
+            return None
+        return snapshot
+
+    def _save_snapshot(self) -> None:
+        snapshot = {
+            "url": self._url,
+            "created": time.time(),
+            "schema": self.graph.schema,
+            "structured_schema": self.graph.structured_schema,
+        }
+        try:
+            directory = os.path.dirname(self._snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self._snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._snapshot_path)
+        except (OSError, TypeError) as e:
+            print(f"Failed to save the Neo4j schema snapshot: {e}")
@@ -0,0 +1,53 @@
+"""
+This module provides the base of the graph wrappers that change how queries run while passing
+everything else through to the wrapped graph, so the wrappers stack: `metrics.TimedGraph` times
+the queries of a `bounded_graph.BoundedGraph`, which bounds those of a Neo4jGraph.
+
+Key Components:
+- GraphWrapper: A GraphStore delegating the schema, schema refreshes, document imports and any
+  other attribute to the wrapped graph. Subclasses override `query`.
+
+Usage:
+- `class TimedGraph(GraphWrapper)` and `class BoundedGraph(GraphWrapper)` call
+  `super().__init__(graph)` and implement `query`.
+"""
+
+
+# Standard library imports
+from typing import Any, Dict, List
+
+# Third-party imports
+from langchain_community.graphs.graph_store import GraphStore
+
+
+class GraphWrapper(GraphStore):
+    """
+    A graph passing everything through to the graph it wraps.
+
+    Attributes:
+        graph (GraphStore): The wrapped graph.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getattr__(self, name):
+        # Everything but `query` (schema, structured_schema, driver settings...) is the wrapped graph's
+        return getattr(self.graph, name)
+
+    @property
+    def get_schema(self) -> str:
+        return self.graph.get_schema
+
+    @property
+    def get_structured_schema(self) -> Dict[str, Any]:
+        return self.graph.get_structured_schema
+
+    def refresh_schema(self) -> None:
+        self.graph.refresh_schema()
+
+    def add_graph_documents(self, graph_documents, include_source: bool = False) -> None:
+        self.graph.add_graph_documents(graph_documents, include_source)
+
+    def query(self, query: str, params: dict = {}) -> List[Dict[str, Any]]:
+        return self.graph.query(query, params)
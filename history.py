@@ -0,0 +1,172 @@
+"""
+This module keeps the chat history sent to the agent within a token budget. Previously every turn
+was appended to a list forever and the whole list was converted to messages on every turn, so
+prompt size, cost and latency grew with the length of the conversation until the model's
+context limit was reached.
+
+Key Components:
+- `count_tokens`: Counts the tokens of a message with tiktoken, or estimates them when its
+  vocabulary cannot be downloaded.
+- HistoryManager: Stores each turn as ready-made messages together with its token count. The
+  most recent turns are kept verbatim within the budget; older turns are folded into a running
+  summary written by the language model, and feedback instructions are pinned so they are never
+  dropped.
+
+Functionality:
+- Messages are built once, when a turn is added, and the list handed to the prompt is cached
+  until the history changes. Summarization happens lazily, only when turns have left the budget
+  since the last summary, and only the new turns are sent along with the previous summary.
+
+Usage:
+- `main.new_chat_history` creates a manager for each conversation; `utils.format_chat_history`
+  hands its messages to the agent prompt.
+"""
+
+
+# Standard library imports
+from typing import List, Optional
+import threading
+
+# Third-party imports
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+import tiktoken
+
+# Application-specific imports
+from deadline import DeadlineExceeded
+import prompts
+
+
+# Fixed cost OpenAI adds to every chat message on top of its content
+_TOKENS_PER_MESSAGE = 4
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens a piece of text takes up as a chat message.
+
+    Parameters:
+        text (str): The content of the message.
+
+    Returns:
+        int: The number of tokens, including the per-message overhead.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model("gpt-4")
+        except Exception as e:
+            # tiktoken downloads its vocabulary on first use; offline, estimate instead
+            print(f"Estimating token counts, tiktoken is unavailable: {e}")
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1 + _TOKENS_PER_MESSAGE
+    return len(_encoding.encode(text)) + _TOKENS_PER_MESSAGE
+
+
+class HistoryManager():
+    """
+    The history of one conversation, bounded by a token budget.
+
+    Attributes:
+        llm (BaseChatModel): The model used to summarize evicted turns, or None to drop them.
+        max_tokens (int): The budget for the recent turns kept verbatim.
+    """
+
+    def __init__(self, llm=None, max_tokens: int = 2000):
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self._turns: List[List[BaseMessage]] = []
+        self._turn_tokens: List[int] = []
+        self._tokens = 0
+        self._pinned: List[BaseMessage] = []
+        self._evicted: List[BaseMessage] = []
+        self._summary = ""
+        self._messages: Optional[List[BaseMessage]] = None
+        self._lock = threading.Lock()
+
+    def add_turn(self, user_input: str, output: str) -> None:
+        """
+        Record a question and the bot's answer, evicting the oldest turns beyond the budget.
+
+        Parameters:
+            user_input (str): The natural language input from a user.
+            output (str): The bot's response.
+        """
+        turn = [HumanMessage(content=user_input), AIMessage(content=output)]
+        tokens = count_tokens(user_input) + count_tokens(output)
+        with self._lock:
+            self._turns.append(turn)
+            self._turn_tokens.append(tokens)
+            self._tokens += tokens
+            # Always keep the latest turn so follow-up questions can be resolved
+            while self._tokens > self.max_tokens and len(self._turns) > 1:
+                self._evicted.extend(self._turns.pop(0))
+                self._tokens -= self._turn_tokens.pop(0)
+            self._messages = None
+
+    def add_feedback(self, feedback: str) -> None:
+        """
+        Pin a feedback instruction so it stays in the history for the rest of the conversation.
+
+        Parameters:
+            feedback (str): The feedback, e.g. "Feedback: Please refer to me as Mrs. Doubtfire".
+        """
+        with self._lock:
+            self._pinned.append(HumanMessage(content=feedback))
+            self._messages = None
+
+    @property
+    def pinned(self) -> List[str]:
+        """The pinned feedback instructions, oldest first."""
+        return [message.content for message in self._pinned]
+
+    @property
+    def summary(self) -> str:
+        """The running summary of the turns that left the budget."""
+        return self._summary
+
+    def has_turns(self) -> bool:
+        """Whether any question has been answered in this conversation yet."""
+        return bool(self._turns or self._evicted or self._summary)
+
+    def messages(self) -> List[BaseMessage]:
+        """
+        Return the messages to place in the prompt: the summary of older turns, the pinned
+        feedback and the recent turns, in that order.
+
+        Returns:
+            List[BaseMessage]: The chat history messages.
+        """
+        with self._lock:
+            if self._evicted:
+                self._summarize()
+            if self._messages is None:
+                messages = []
+                if self._summary:
+                    messages.append(SystemMessage(content=f"Summary of the earlier conversation: {self._summary}"))
+                messages.extend(self._pinned)
+                for turn in self._turns:
+                    messages.extend(turn)
+                self._messages = messages
+            return list(self._messages)
+
+    def _summarize(self) -> None:
+        evicted, self._evicted = self._evicted, []
+        self._messages = None
+        if self.llm is None:
+            return
+        turns = "\n".join(
+            f"{'User' if isinstance(message, HumanMessage) else 'Bot'}: {message.content}" for message in evicted
+        )
+        try:
+            response = self.llm.invoke(prompts.history_summary_prompt.format(summary=self._summary or "None", turns=turns))
+            self._summary = response.content.strip()
+        except DeadlineExceeded:
+            # Keep the turns for the next summary rather than working on past the turn's deadline
+            self._evicted = evicted + self._evicted
+            raise
+        except Exception as e:
+            # The evicted turns are lost, but the conversation can carry on with the previous summary
+            print(f"Failed to summarize the chat history: {e}")
@@ -3,26 +3,210 @@ This module provides a simplified interface for accessing OpenAI's GPT models vi
 
 Key Components:
 - LLMCustom: Manages the initialization and access to the GPT model using environment variables for secure API key configuration.
+- ResilientChatOpenAI: A ChatOpenAI that bounds every request by connect and read timeouts and by the deadline of the current turn, retries transient errors with jittered backoff, and can hedge a slow request by sending a duplicate once it has taken longer than the recent 95th percentile, keeping whichever answer arrives first.
 
 Functionality:
 - Initializes the ChatOpenAI class with a zero temperature setting to ensure deterministic model responses and provides a method to retrieve the model object.
+- Timeouts, retries and hedging are configured with OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT, LLM_MAX_RETRIES, LLM_HEDGE and LLM_HEDGE_DELAY.
 
 Usage:
 - Designed for applications needing advanced NLP capabilities like chatbots or automated content generators, enabling easy integration of OpenAI’s language models.
 """
 
 # Standard library imports
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
+from typing import Any, Optional
+import asyncio
+import contextvars
 import os
+import time
 
 # Third-party imports
+from langchain_core.pydantic_v1 import PrivateAttr
 from langchain_openai import ChatOpenAI
+import httpx
+import openai
+
+# Application-specific imports
+import deadline
+import metrics
 
 load_dotenv()
 
+# Shared by the hedged requests of every model; a hedge only waits for a worker when many are in flight
+_hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv('LLM_HEDGE_WORKERS', '16')), thread_name_prefix="llm-hedge")
+
+def is_transient(error: Exception) -> bool:
+    """Whether an OpenAI error is worth retrying: rate limits, timeouts, connection and server errors."""
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+def retry_after(error: Exception) -> Optional[float]:
+    """The delay in seconds requested by the Retry-After headers of an OpenAI error response, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+class ResilientChatOpenAI(ChatOpenAI):
+    """
+    A ChatOpenAI with deadline-bounded timeouts, jittered retries and optional hedged requests.
+
+    The OpenAI client's own retries should be disabled (`max_retries=0`): they would ignore the
+    deadline of the turn.
+
+    Attributes:
+        retries (int): Retries of a request that failed with a transient error.
+        hedge (bool): Send a duplicate of a request that is slower than usual.
+        hedge_delay (float): The delay, in seconds, after which a request is hedged until enough
+            latencies have been observed to estimate their 95th percentile.
+    """
+    retries: int = 2
+    hedge: bool = False
+    hedge_delay: float = 3.0
+    _latencies: deque = PrivateAttr(default_factory=lambda: deque(maxlen=200))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        if self.streaming:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        generate = super()._generate
+        return deadline.retry(
+            lambda: self._hedged(generate, messages, stop, run_manager, kwargs),
+            is_transient, self.retries, retry_after=retry_after, stage="llm",
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        if self.streaming:
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        agenerate = super()._agenerate
+        return await deadline.aretry(
+            lambda: self._ahedged(agenerate, messages, stop, run_manager, kwargs),
+            is_transient, self.retries, retry_after=retry_after, stage="llm",
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        # Tokens may already have been passed on, so a stream is neither retried nor hedged
+        yield from super()._stream(messages, stop=stop, run_manager=run_manager, **self._with_timeout(kwargs))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **self._with_timeout(kwargs)):
+            yield chunk
+
+    def _with_timeout(self, kwargs: dict) -> dict:
+        # Cap the client's timeouts by the time left in the turn
+        left = deadline.timeout(None, "llm")
+        if left is None:
+            return kwargs
+        configured = self.request_timeout
+        if isinstance(configured, httpx.Timeout):
+            request_timeout = httpx.Timeout(
+                _smaller(configured.read, left), connect=_smaller(configured.connect, left),
+                write=_smaller(configured.write, left), pool=_smaller(configured.pool, left),
+            )
+        else:
+            request_timeout = _smaller(configured, left)
+        return {**kwargs, "timeout": request_timeout}
+
+    def _current_hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        latencies = sorted(self._latencies)
+        if len(latencies) < 20:
+            return self.hedge_delay
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _hedged(self, generate, messages, stop, run_manager, kwargs):
+        kwargs = self._with_timeout(kwargs)
+        delay = self._current_hedge_delay()
+        if delay is None:
+            return self._timed(generate, messages, stop, run_manager, kwargs)
+        # Each request runs in the turn's context, so it sees the turn's deadline and metrics
+        primary = _hedge_executor.submit(contextvars.copy_context().run, self._timed, generate, messages, stop,
+                                         run_manager, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        metrics.count("llm_hedged")
+        # Only the first request reports to the callbacks, so tokens and spans are not counted twice
+        hedge = _hedge_executor.submit(contextvars.copy_context().run, self._timed, generate, messages, stop,
+                                       None, kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        metrics.count("llm_hedge_won")
+                    # A request already sent cannot be recalled; the other one finishes in the background
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def _ahedged(self, agenerate, messages, stop, run_manager, kwargs):
+        kwargs = self._with_timeout(kwargs)
+        delay = self._current_hedge_delay()
+        if delay is None:
+            return await self._atimed(agenerate, messages, stop, run_manager, kwargs)
+        primary = asyncio.ensure_future(self._atimed(agenerate, messages, stop, run_manager, kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        metrics.count("llm_hedged")
+        hedge = asyncio.ensure_future(self._atimed(agenerate, messages, stop, None, kwargs))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            metrics.count("llm_hedge_won")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # Unlike threads, the slower request can be abandoned
+            for task in pending:
+                task.cancel()
+
+    def _timed(self, generate, messages, stop, run_manager, kwargs):
+        started = time.monotonic()
+        result = generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self._latencies.append(time.monotonic() - started)
+        return result
+
+    async def _atimed(self, agenerate, messages, stop, run_manager, kwargs):
+        started = time.monotonic()
+        result = await agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self._latencies.append(time.monotonic() - started)
+        return result
+
+def _smaller(configured: Optional[float], left: float) -> float:
+    return left if configured is None else min(configured, left)
+
 class LLMCustom():
     def __init__(self):
-        self.llm = ChatOpenAI(model="gpt-4-0125-preview", temperature=0, api_key=os.getenv('API_KEY'))
-    
+        self.llm = ResilientChatOpenAI(
+            model="gpt-4-0125-preview", temperature=0, api_key=os.getenv('API_KEY'),
+            timeout=httpx.Timeout(float(os.getenv('OPENAI_READ_TIMEOUT', '60')),
+                                  connect=float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))),
+            # Retries are made by ResilientChatOpenAI, which knows the deadline of the turn
+            max_retries=0,
+            retries=int(os.getenv('LLM_MAX_RETRIES', '2')),
+            hedge=os.getenv('LLM_HEDGE', '0') == '1',
+            hedge_delay=float(os.getenv('LLM_HEDGE_DELAY', '3')),
+        )
+
     def get_llm_obj(self):
         return self.llm
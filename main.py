@@ -7,52 +7,171 @@ Components:
 - InformationTool: A specific tool built on LangChain's framework that allows querying detailed information about entities like movies or actors through both structured queries and natural language inputs.
 - AgentExecutor: Orchestrates the flow of data through different processing layers, from input reception to response generation, leveraging multiple custom and built-in LangChain tools.
 
+The graph connection, language model, QA chain and agent are created lazily on first use (see `get_graph`, `get_llm`, `get_chain` and `get_agent_executor`), so importing this module is fast and does not require the database to be reachable. The former module attributes, such as `main.agent_executor`, remain available and are built on first access.
+
 The module demonstrates how to bind a language model with specific functionalities (tools) that enhance its capabilities, making it more suitable for specialized tasks such as answering queries about movies. It includes example setups for prompt templates and agent configurations that are tailored to improve interaction quality and reliability.
 """
 
 
 # Standard library imports
-from typing import Type
-import threading
-import queue
+from typing import Dict, List, Optional, Type
+import argparse
+import asyncio
+import os
 # Third-party imports
 from langchain.agents import AgentExecutor
-from langchain.agents.format_scratchpad import format_to_openai_function_messages
-from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
+from langchain.agents.format_scratchpad.openai_tools import format_to_openai_tool_messages
+from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
 from langchain.chains import GraphCypherQAChain
-from langchain.pydantic_v1 import BaseModel, Field
+from langchain.pydantic_v1 import BaseModel, Field, validator
 from langchain.tools import BaseTool
 # from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import (ChatPromptTemplate, FewShotPromptTemplate,
                                      MessagesPlaceholder, PromptTemplate)
-from langchain_core.utils.function_calling import convert_to_openai_function
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
 # Application-specific imports
 import prompts
+from answer_cache import AnswerCache, DbmBackend, JsonFileBackend, answer_key, is_context_dependent
+from bounded_graph import BoundedGraph
+from context_cache import EntityContextCache, GraphVersionProbe
+from context_store import ContextStore
+import deadline
+from cypher_cache import CachedCypherQAChain, CypherCache, normalize_question
+from entity_index import EntityIndex, normalize
+from example_selector import NgramExampleSelector, load_examples
+from graph_replica import GraphReplica
 from graph_setup import Neo4jCustomGraph
+from history import HistoryManager
 from llm import LLMCustom
+import metrics
+from router import FastPathRouter
+from singleflight import SingleFlight
+import streaming
 import utils
 
 
-# Establish a connection with the Neo4j graph
-graph = Neo4jCustomGraph().get_graph_object()
+# Heavy objects (the Neo4j connection, the language model, the QA chain and the agent) are built
+# lazily, on first use, so importing this module is cheap and needs no network access.
+@utils.lazy
+def get_graph_setup() -> Neo4jCustomGraph:
+    # Establish a connection with the Neo4j graph
+    graph_setup = Neo4jCustomGraph()
+    graph_setup.get_graph_object()  # Raises ConnectionError, so the next call tries to connect again
+    # A background schema refresh that finds a new schema must rebuild the QA chain
+    graph_setup.add_schema_listener(get_chain.reset)
+    graph_setup.add_schema_listener(get_cached_chain.reset)
+    return graph_setup
+
+@utils.lazy
+def get_graph():
+    return get_graph_setup().get_graph_object()
+
+@utils.lazy
+def get_graph_replica() -> Optional[GraphReplica]:
+    # An optional in-memory copy of the graph, serving entity contexts without Neo4j round trips
+    path = os.getenv('GRAPH_REPLICA_PATH')
+    if path and os.path.exists(path):
+        replica = GraphReplica.from_file(path)
+        # Catch up with changes made since the file was written, without delaying startup
+        replica.refresh_in_background(get_graph)
+    elif path or os.getenv('GRAPH_REPLICA', '0') == '1':
+        replica = GraphReplica.from_graph(get_graph())
+        if path:
+            replica.save(path)
+    else:
+        return None
+    return replica
+
+@utils.lazy
+def get_entity_index() -> EntityIndex:
+    # Index every movie and person once so entities are resolved locally instead of by a label scan
+    replica = get_graph_replica()
+    if replica is None:
+        return EntityIndex.from_graph(get_graph())
+    entity_index = EntityIndex()
+    entity_index.build(replica.entity_rows())
+    replica.add_refresh_listener(lambda: entity_index.build(replica.entity_rows()))
+    return entity_index
+
+@utils.lazy
+def get_context_store() -> Optional[ContextStore]:
+    # An optional precomputed file of every entity context, memory-mapped and shared by all workers
+    path = os.getenv('CONTEXT_STORE_PATH')
+    if not path:
+        return None
+    return ContextStore(path)
 
-# Initialize the custom language model
-llm = LLMCustom().get_llm_obj()
+@utils.lazy
+def get_context_cache() -> EntityContextCache:
+    # Cache entity contexts until the graph version changes, then rebuild the entity index as well
+    graph = get_graph()
+    context_cache = EntityContextCache(
+        GraphVersionProbe(graph, interval=float(os.getenv('GRAPH_VERSION_PROBE_INTERVAL', '5'))),
+        maxsize=int(os.getenv('CONTEXT_CACHE_SIZE', '2048')),
+    )
+    replica = get_graph_replica()
+    if replica is None:
+        # Rebuilt off the request thread, which keeps resolving against the previous index meanwhile
+        context_cache.add_invalidation_listener(lambda: get_entity_index().refresh_in_background(graph))
+    else:
+        # The replica rebuilds the entity index itself once it has pulled the changes
+        context_cache.add_invalidation_listener(lambda: replica.refresh_in_background(graph))
+    context_store = get_context_store()
+    if context_store is not None and os.getenv('CONTEXT_STORE_REBUILD', '0') == '1':
+        # Only one process should rebuild the shared file; the others map it once it is replaced
+        context_cache.add_invalidation_listener(lambda: context_store.rebuild_in_background(graph))
+    return context_cache
+
+@utils.lazy
+def get_answer_cache() -> Optional[AnswerCache]:
+    # Remember final answers so repeated, history-independent questions skip the fast path and agent.
+    # Off unless enabled: stored answers outlive changes to the model and the prompts
+    if os.getenv('ANSWER_CACHE', '0') != '1':
+        return None
+    path = os.getenv('ANSWER_CACHE_PATH', '.cache/answers.json')
+    maxsize = int(os.getenv('ANSWER_CACHE_SIZE', '1024'))
+    backend = None
+    if path:
+        if os.getenv('ANSWER_CACHE_BACKEND', 'json') == 'dbm':
+            try:
+                backend = DbmBackend(path)
+            except OSError as e:
+                # Another worker owns the database; this one keeps its answers in memory
+                print(f"Keeping answers in memory only: {e}")
+        else:
+            backend = JsonFileBackend(path, maxsize=maxsize)
+    return AnswerCache(
+        backend,
+        maxsize=maxsize,
+        ttl=float(os.getenv('ANSWER_CACHE_TTL', str(24 * 3600))),
+    )
+
+@utils.lazy
+def get_llm():
+    # Initialize the custom language model
+    return LLMCustom().get_llm_obj()
 
 # Define prompt templates for generating and formatting messages
 example_prompt = PromptTemplate.from_template(
     "User input: {question}\nCypher query: {query}"
 )
 
-# Create a few-shot prompt with predefined examples for structured learning
-few_shot_prompt = FewShotPromptTemplate(
-    examples=prompts.examples,
-    example_prompt=example_prompt,
-    prefix=prompts.prefix,
-    suffix=prompts.suffix,
-    input_variables=["question", "schema"],
-)
+@utils.lazy
+def get_few_shot_prompt() -> FewShotPromptTemplate:
+    # Select only the examples most similar to each question, so the example store can grow freely
+    example_selector = NgramExampleSelector(prompts.examples, k=int(os.getenv('FEW_SHOT_K', '5')))
+    if os.getenv('EXAMPLES_PATH'):
+        example_selector.add_examples(load_examples(os.getenv('EXAMPLES_PATH')))
+
+    # Create a few-shot prompt with the selected examples for structured learning
+    return FewShotPromptTemplate(
+        example_selector=example_selector,
+        example_prompt=example_prompt,
+        prefix=prompts.prefix,
+        suffix=prompts.suffix,
+        input_variables=["question", "schema"],
+    )
 
 # Construct a chat prompt template incorporating messages and placeholders
 prompt = ChatPromptTemplate.from_messages(
@@ -64,14 +183,152 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-# Initialize the QA chain for handling Cypher queries using a natural language input
-chain = GraphCypherQAChain.from_llm(
-            graph=graph, llm=llm, cypher_prompt=few_shot_prompt, validate_cypher=True
-        )
+@utils.lazy
+def get_chain() -> GraphCypherQAChain:
+    # Initialize the QA chain for handling Cypher queries using a natural language input. The same
+    # model serves both steps, configured separately so each reports to its own metrics stage.
+    # Generated statements run through a BoundedGraph, so broad queries cannot flood the answer prompt.
+    bounded_graph = BoundedGraph(
+        get_graph(),
+        max_rows=int(os.getenv('CYPHER_MAX_ROWS', '25')),
+        max_tokens=int(os.getenv('CYPHER_MAX_TOKENS', '2000')),
+        scan_limit=int(os.getenv('CYPHER_SCAN_LIMIT', '1000')),
+    )
+    return GraphCypherQAChain.from_llm(
+        graph=metrics.timed_graph(bounded_graph, "cypher_execution"),
+        cypher_llm=metrics.with_metrics(get_llm(), "cypher_generation"),
+        qa_llm=metrics.with_metrics(get_llm(), "qa_answer"),
+        cypher_prompt=get_few_shot_prompt(), validate_cypher=True, return_intermediate_steps=True,
+        top_k=bounded_graph.max_rows + 1,  # Room for the truncation note placed before the rows
+    )
+
+@utils.lazy
+def get_cached_chain() -> CachedCypherQAChain:
+    # Remember the Cypher generated for each question so repeated questions skip both LLM calls
+    chain = get_chain()
+    return CachedCypherQAChain(
+        chain,
+        chain.graph,
+        CypherCache(
+            path=os.getenv('CYPHER_CACHE_PATH', '.cache/cypher_cache.json'),
+            maxsize=int(os.getenv('CYPHER_CACHE_SIZE', '1024')),
+            ttl=float(os.getenv('CYPHER_CACHE_TTL', str(7 * 24 * 3600))),
+        ),
+    )
+
+def get_entity_context(node_id: str) -> str:
+    """
+    Return the context of a resolved node, built from the local graph replica when one is
+    enabled, else read from the precomputed context store when it is up to date, else from the
+    entity context cache when possible.
+
+    Parameters:
+        node_id (str): The element id of the node.
+
+    Returns:
+        str: The context string built by `prompts.description_by_id_query`.
+
+    Raises:
+        IndexError: If the node has no context, e.g. because it has no relationships.
+    """
+    context = _local_entity_context(node_id)
+    if context is None:
+        # Sessions missing the same node at the same time share one description query
+        context = context_flight.do(node_id, _query_entity_context, node_id)
+    return context
+
+def get_entity_contexts(node_ids: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Return the contexts of several resolved nodes, served like `get_entity_context`, except that
+    the contexts missing locally are read with a single query.
+
+    Parameters:
+        node_ids (List[str]): The element ids of the nodes.
+
+    Returns:
+        Dict[str, Optional[str]]: The context of each node, None for nodes without context.
+    """
+    contexts: Dict[str, Optional[str]] = {}
+    missing = []
+    for node_id in dict.fromkeys(node_ids):
+        try:
+            context = _local_entity_context(node_id)
+        except IndexError:
+            contexts[node_id] = None  # The replica knows the node has no context
+            continue
+        if context is None:
+            missing.append(node_id)
+        contexts[node_id] = context
+    if len(missing) == 1:
+        try:
+            contexts[missing[0]] = context_flight.do(missing[0], _query_entity_context, missing[0])
+        except IndexError:
+            pass
+    elif missing:
+        with metrics.span("description_query", entities=len(missing)):
+            rows = get_graph().query(prompts.descriptions_by_ids_query, params={"ids": missing})
+        context_cache = get_context_cache()
+        for row in rows:
+            contexts[row["id"]] = row["context"]
+            context_cache.put(row["id"], row["context"])
+    return contexts
+
+def _local_entity_context(node_id: str) -> Optional[str]:
+    # The context of a node without asking Neo4j, or None when it must be queried
+    replica = get_graph_replica()
+    if replica is not None:
+        try:
+            context = replica.context(node_id)
+        except KeyError:
+            pass  # A node created since the last refresh; ask Neo4j
+        else:
+            if context is None:
+                raise IndexError(node_id)
+            metrics.count("replica_hit")
+            return context
+    context_cache = get_context_cache()
+    context_store = get_context_store()
+    if context_store is not None and context_store.is_current(context_cache.version):
+        context = context_store.get(node_id)
+        if context is not None:
+            metrics.count("context_store_hit")
+            return context
+    context = context_cache.get(node_id)
+    metrics.count("context_cache_miss" if context is None else "context_cache_hit")
+    return context
+
+def _query_entity_context(node_id: str) -> str:
+    with metrics.span("description_query"):
+        data = get_graph().query(prompts.description_by_id_query, params={"id": node_id})
+    context = data[0]["context"]
+    get_context_cache().put(node_id, context)
+    return context
+
+# Identical lookups running at the same time, e.g. many sessions asking about a trending title,
+# share one execution and its result or error (see singleflight.py)
+information_flight = SingleFlight("information")
+context_flight = SingleFlight("entity_context")
+chain_flight = SingleFlight("cypher_chain")
+
+def information_key(entities: List[str], user_input: str) -> tuple:
+    """
+    Return the key under which concurrent `get_information_batch` calls are coalesced: calls
+    whose entities and question differ only in case, spacing or punctuation get the same answer.
+
+    Parameters:
+        entities (List[str]): The entities to query information about.
+        user_input (str): The natural language input from a user.
+
+    Returns:
+        tuple: The normalized entities and question.
+    """
+    return (tuple(normalize(entity or "") for entity in entities), normalize_question(user_input))
 
 def get_information(entity: str, user_input: str) -> str:
     """
     Attempt to retrieve information about an entity using a Cypher query.
+    The entity is first resolved to a node id with the in-process entity index and its
+    context is served from the entity context cache when the graph has not changed.
     If unsuccessful, falls back to using the QA chain to process natural language inputs.
 
     Parameters:
@@ -81,15 +338,64 @@ def get_information(entity: str, user_input: str) -> str:
     Returns:
         str: The context information about the entity or the response from the QA chain.
     """
+    get_context_cache().check_version()
     try:
-        data = graph.query(prompts.description_query, params={"candidate": entity})
-        return data[0]["context"]
+        # Resolve the entity in-process (case and typo tolerant) and fetch its node by id
+        node_id = get_entity_index().resolve(entity)
+        if node_id is None:
+            raise IndexError(entity)
+        return get_entity_context(node_id)
     except IndexError:
-        try:
-            response = chain.invoke(user_input)
-        except ValueError:
-            response = "I don't know the answer"
-        return response
+        return ask_chain(user_input)
+
+def get_information_batch(entities: List[str], user_input: str) -> str:
+    """
+    Retrieve information about several entities at once, as `get_information` does for one.
+    Every entity is resolved in-process and the contexts that are not available locally are
+    fetched with a single query. If none of the entities is found, falls back to the QA chain.
+
+    Parameters:
+        entities (List[str]): The entities to query information about.
+        user_input (str): The natural language input from a user.
+
+    Returns:
+        str: The context of each entity under its name, or the response from the QA chain.
+    """
+    entities = [entity for entity in dict.fromkeys(entities) if entity and entity.strip()]
+    if len(entities) <= 1:
+        return get_information(entities[0] if entities else "", user_input)
+    get_context_cache().check_version()
+    entity_index = get_entity_index()
+    node_ids = {entity: entity_index.resolve(entity) for entity in entities}
+    contexts = get_entity_contexts([node_id for node_id in node_ids.values() if node_id is not None])
+    if not any(contexts.values()):
+        return ask_chain(user_input)
+    sections, shown = [], set()
+    for entity, node_id in node_ids.items():
+        if node_id in shown:
+            continue  # Two names of the same movie or person
+        shown.add(node_id)
+        context = contexts.get(node_id) if node_id is not None else None
+        sections.append(f"{entity}:\n{context.strip()}" if context else f"{entity}: not found in the database")
+    return "\n\n".join(sections)
+
+def ask_chain(user_input: str) -> str:
+    """
+    Answer a user input with the QA chain, for questions that do not name a known entity.
+
+    Parameters:
+        user_input (str): The natural language input from a user.
+
+    Returns:
+        str: The response from the QA chain.
+    """
+    metrics.count("chain_fallback")
+    try:
+        # The same question asked concurrently generates and runs its Cypher once
+        response = chain_flight.do(normalize_question(user_input), get_cached_chain().invoke, user_input)
+    except ValueError:
+        response = "I don't know the answer"
+    return response
 
 class InformationInput(BaseModel):
     """
@@ -97,14 +403,19 @@ class InformationInput(BaseModel):
     Uses Pydantic for data validation and settings management.
 
     Attributes:
-        entity (str): The entity concerned, like a movie or person.
+        entities (List[str]): The entities concerned, like movies or people.
         user_input (str): Direct user input in natural language.
     """
-    entity: str = Field(
-        description="The specific entity in question, such as a 'movie' or 'person'. This field accepts both lowercase and uppercase text. The value should clearly identify a single, distinct entity to ensure accurate processing and classification."
+    entities: List[str] = Field(
+        description="The specific entities in question, such as 'movies' or 'persons'. This field accepts both lowercase and uppercase text. Each value should clearly identify a single, distinct entity to ensure accurate processing and classification; list every entity the user input mentions, so they are looked up together."
     )
     user_input: str = Field(description="Direct user input in natural language.")
 
+    @validator("entities", pre=True)
+    def _entities_as_list(cls, value):
+        # A single entity passed as a string, as in the tool's former schema
+        return [value] if isinstance(value, str) else value
+
 class InformationTool(BaseTool):
     """
     A tool for querying information about entities from a graph database.
@@ -115,46 +426,285 @@ class InformationTool(BaseTool):
         args_schema (Type[BaseModel]): The schema for arguments this tool accepts.
     """
     name = "Information"
-    description = "Tool to query information about entities like movies or people."
+    description = "Tool to query information about entities like movies or people. Pass every entity of a question in one call."
     args_schema: Type[BaseModel] = InformationInput
 
-    def _run(self, entity: str, user_input: str) -> str:
+    def _run(self, entities: List[str], user_input: str) -> str:
         """Execute the information retrieval tool."""
-        return get_information(entity, user_input=user_input)
+        return information_flight.do(information_key(entities, user_input), get_information_batch, entities, user_input)
+
+    async def _arun(self, entities: List[str], user_input: str) -> str:
+        """Execute the information retrieval tool without blocking the event loop."""
+        return await information_flight.ado(information_key(entities, user_input), get_information_batch,
+                                            entities, user_input)
 
 tools = [InformationTool()]
 
-llm_with_tools = llm.bind(functions=[convert_to_openai_function(t) for t in tools])
-
-# Define the agent with a dictionary that transforms and processes input data
-agent = (
-    {
-        "user_input": lambda x: x["input"],
-        "input": lambda x: x["input"],
-        # Processes the 'chat_history' if it exists, otherwise initializes an empty list
-        "chat_history": lambda x: utils.format_chat_history(x.get("chat_history", [])),
-        # Formats function call intermediate steps to be compatible with OpenAI's message format
-        "agent_scratchpad": lambda x: format_to_openai_function_messages(
-            x["intermediate_steps"]
-        ),
-    }
-    | prompt  # Chains the prompt to the input processing for generating structured input
-    | llm_with_tools  # Integrates language model with additional tools for processing
-    | OpenAIFunctionsAgentOutputParser()  # Parses output from the language model to a usable format
-)
+class DeadlineAgentExecutor(AgentExecutor):
+    """
+    An AgentExecutor that stops planning further steps once the deadline of the current turn has
+    passed. The deadline is read for every turn and includes the time spent before the agent
+    started, unlike `max_execution_time`, which is fixed and counts from the executor's start.
+    """
+
+    def _should_continue(self, iterations: int, time_elapsed: float) -> bool:
+        # Raised rather than returning False, which would answer with the executor's own
+        # "Agent stopped" notice instead of the turn's apology
+        deadline.check("agent step")
+        return super()._should_continue(iterations, time_elapsed)
+
+@utils.lazy
+def get_agent_executor() -> AgentExecutor:
+    # Tools rather than functions, so the model can request several lookups in one step; the async
+    # executor runs them concurrently
+    llm_with_tools = get_llm().bind(tools=[convert_to_openai_tool(t) for t in tools]).with_config(
+        tags=[streaming.AGENT_LLM_TAG]  # Lets streamed answer tokens be told apart from the QA chain's
+    )
+    llm_with_tools = metrics.with_metrics(llm_with_tools, "agent_llm")
+
+    # Define the agent with a dictionary that transforms and processes input data
+    agent = (
+        {
+            "user_input": lambda x: x["input"],
+            "input": lambda x: x["input"],
+            # Processes the 'chat_history' if it exists, otherwise initializes an empty list
+            "chat_history": lambda x: utils.format_chat_history(x.get("chat_history", [])),
+            # Formats tool call intermediate steps to be compatible with OpenAI's message format
+            "agent_scratchpad": lambda x: format_to_openai_tool_messages(
+                x["intermediate_steps"]
+            ),
+        }
+        | prompt  # Chains the prompt to the input processing for generating structured input
+        | llm_with_tools  # Integrates language model with additional tools for processing
+        | OpenAIToolsAgentOutputParser()  # Parses output from the language model to a usable format
+    )
+
+    # The executor manages the lifecycle of the agent and handles interactions with tools
+    # Stop planning further steps once the turn's deadline has passed; calls in flight are bounded by it too
+    return DeadlineAgentExecutor(agent=agent, tools=tools)
 
-# The executor manages the lifecycle of the agent and handles interactions with tools
-agent_executor = AgentExecutor(agent=agent, tools=tools)
+@utils.lazy
+def get_router() -> FastPathRouter:
+    # Answers frequent question shapes with parameterized Cypher, bypassing the agent's LLM calls
+    return FastPathRouter(get_graph(), get_entity_index(), get_entity_context)
+
+def answer_fast_path(user_input, chat_history):
+    """
+    Answer a user input with the fast-path router, if it has a supported shape.
+
+    Parameters:
+        user_input (str): The natural language input from a user.
+        chat_history (HistoryManager): The conversation so far.
+
+    Returns:
+        Optional[str]: The answer, or None when the agent must handle the input.
+    """
+    if os.getenv('FAST_PATH', '1') == '0':
+        return None
+    with metrics.span("fast_path") as span:
+        get_context_cache().check_version()
+        output = get_router().route(user_input, chat_history)
+        span.set(outcome="miss" if output is None else "hit")
+    metrics.count("fast_path_miss" if output is None else "fast_path_hit")
+    return output
+
+def answer_without_agent(user_input, chat_history):
+    """
+    Answer a user input from the answer cache or on the fast path, if possible. Fast-path answers
+    are added to the cache.
+
+    Parameters:
+        user_input (str): The natural language input from a user.
+        chat_history (HistoryManager): The conversation so far.
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: The answer cache key of the input, None when its
+            answer must not be cached, and the answer, None when the agent must handle the input.
+    """
+    key = None
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        if is_context_dependent(user_input, chat_history):
+            metrics.count("answer_cache_skip")
+        else:
+            context_cache = get_context_cache()
+            context_cache.check_version()
+            key = answer_key(user_input, chat_history, context_cache.version)
+            output = answer_cache.get(key)
+            metrics.count("answer_cache_miss" if output is None else "answer_cache_hit")
+            if output is not None:
+                return key, output
+    output = answer_fast_path(user_input, chat_history)
+    if output is not None:
+        remember_answer(key, output)
+    return key, output
+
+def remember_answer(key, output):
+    """
+    Add the answer of a turn to the answer cache.
+
+    Parameters:
+        key (Optional[str]): The key returned by `answer_without_agent`, or None to skip caching.
+        output (str): The answer.
+    """
+    left = deadline.remaining()
+    # An answer given after the deadline may be the executor's notice that it stopped early
+    if key is not None and output and output != AGENT_STOPPED_OUTPUT and (left is None or left > 0):
+        get_answer_cache().put(key, output)
+
+# Module attributes kept for callers such as demos.py; each one is built on first access
+_LAZY_ATTRIBUTES = {
+    "graph": get_graph,
+    "llm": get_llm,
+    "graph_replica": get_graph_replica,
+    "entity_index": get_entity_index,
+    "context_store": get_context_store,
+    "context_cache": get_context_cache,
+    "answer_cache": get_answer_cache,
+    "few_shot_prompt": get_few_shot_prompt,
+    "chain": get_chain,
+    "cached_chain": get_cached_chain,
+    "agent_executor": get_agent_executor,
+    "router": get_router,
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# The answer given when a turn runs out of time
+DEADLINE_REPLY = "Sorry, answering took too long. Please try again."
+# What AgentExecutor answers when it runs out of iterations (its "force" early stopping)
+AGENT_STOPPED_OUTPUT = "Agent stopped due to max iterations."
+
+def is_incomplete(response: dict) -> bool:
+    """
+    Tell whether a response is a notice that the turn stopped before answering, rather than an answer.
+
+    Parameters:
+        response (dict): A response of `respond` or `aget_chat_response`.
+
+    Returns:
+        bool: True when the turn ran out of time or the agent ran out of iterations.
+    """
+    return bool(response.get("deadline_exceeded")) or response.get("output") == AGENT_STOPPED_OUTPUT
+
+def turn_deadline() -> Optional[float]:
+    """
+    Return the time budget of a chat turn, shared by every model call and graph query it makes.
+
+    Returns:
+        Optional[float]: CHAT_TURN_DEADLINE in seconds, or None when it is set to 0.
+    """
+    seconds = float(os.getenv('CHAT_TURN_DEADLINE', '60'))
+    return seconds if seconds > 0 else None
+
+def new_chat_history() -> HistoryManager:
+    """
+    Create the history of a new conversation, bounded by the HISTORY_MAX_TOKENS budget.
+
+    Returns:
+        HistoryManager: An empty, token-budgeted chat history.
+    """
+    return HistoryManager(llm=get_llm(), max_tokens=int(os.getenv('HISTORY_MAX_TOKENS', '2000')))
+
+def respond(user_input, chat_history):
+    """
+    Generate the response to a user input, from the answer cache or on the fast path when
+    possible, else with the agent.
+
+    Parameters:
+        user_input (str): The natural language input from a user.
+        chat_history (HistoryManager): The conversation so far.
+
+    Returns:
+        dict: The response, with the answer under the "output" key and `deadline_exceeded` set
+            when the turn ran out of time.
+    """
+    with metrics.turn(), deadline.budget(turn_deadline()):
+        try:
+            key, output = answer_without_agent(user_input, chat_history)
+            if output is not None:
+                return {"input": user_input, "output": output}
+            response = get_agent_executor().invoke({"input": user_input, "chat_history": chat_history})
+        except deadline.DeadlineExceeded:
+            return {"input": user_input, "output": DEADLINE_REPLY, "deadline_exceeded": True}
+        remember_answer(key, response["output"])
+        return response
 
 def get_chat_response(user_input, chat_history, response_q):
-    data = agent_executor.invoke({"input": user_input, "chat_history": chat_history})
-    response_q.put(data)
-    
-def run_chat():
+    response_q.put(respond(user_input, chat_history))
+
+async def aget_chat_response(user_input, chat_history):
+    """
+    Generate the response to a user input without blocking the event loop, from the answer
+    cache or on the fast path when possible, else with the agent.
+
+    Parameters:
+        user_input (str): The natural language input from a user.
+        chat_history (HistoryManager): The conversation so far.
+
+    Returns:
+        dict: The response, with the answer under the "output" key and `deadline_exceeded` set
+            when the turn ran out of time.
+    """
+    with metrics.turn(), deadline.budget(turn_deadline()):
+        try:
+            key, output = await asyncio.to_thread(answer_without_agent, user_input, chat_history)
+            if output is not None:
+                return {"input": user_input, "output": output}
+            response = await get_agent_executor().ainvoke({"input": user_input, "chat_history": chat_history})
+        except deadline.DeadlineExceeded:
+            return {"input": user_input, "output": DEADLINE_REPLY, "deadline_exceeded": True}
+        # Storing the answer may rewrite the cache file, which must not stall the other sessions
+        await asyncio.to_thread(remember_answer, key, response["output"])
+        return response
+
+async def astream_chat_response(user_input, chat_history):
+    """
+    Stream the response to a user input as the events of `streaming.astream_chat`. A cached or
+    fast-path answer is produced as a single "final" event.
+
+    Parameters:
+        user_input (str): The natural language input from a user.
+        chat_history (HistoryManager): The conversation so far.
+
+    Yields:
+        dict: Tool progress, answer tokens and finally the complete output.
+    """
+    with metrics.turn(), deadline.budget(turn_deadline()):
+        try:
+            key, output = await asyncio.to_thread(answer_without_agent, user_input, chat_history)
+            if output is not None:
+                yield {"type": "final", "content": output}
+                return
+            async for event in streaming.astream_chat(get_agent_executor(), user_input, chat_history):
+                if event["type"] == "final":
+                    await asyncio.to_thread(remember_answer, key, event["content"])
+                yield event
+        except deadline.DeadlineExceeded:
+            yield {"type": "final", "content": DEADLINE_REPLY}
+
+def run_chat(stream: bool = False):
     """
     Runs the chat loop, processing user inputs and displaying responses.
     Collects feedback on the responses for improvement.
+
+    Parameters:
+        stream (bool): Print answer tokens and tool progress as they arrive.
     """
+    if metrics.ENABLED and os.getenv('CHATBOT_METRICS_PORT'):
+        # Expose the per-stage latency metrics of this session on http://127.0.0.1:<port>/metrics
+        metrics.start_http_server(int(os.getenv('CHATBOT_METRICS_PORT')))
+    asyncio.run(arun_chat(stream))
+
+async def arun_chat(stream: bool = False):
+    """
+    The chat loop behind `run_chat`. Turns run on a single event loop, so waiting on the
+    language model and the graph does not tie up a thread per turn.
+    """
+
     print("****")
     print()
     print("Welcome to the Movie Chatbot! I can provide information about movies and actors from my database.")
@@ -162,42 +712,39 @@ def run_chat():
     print()
     print("****")
     print()
-    chat_history = []  # Initializes chat history to store conversation
+    chat_history = new_chat_history()  # Initializes chat history to store conversation
     while True:
-        user_input = input("You: ")  # Takes input from the user
+        user_input = await utils.ainput("You: ")  # Takes input from the user
         # Exit loop if user types "quit" or "exit"
         if user_input.lower() in ["quit", "exit"]:
             break
         elif user_input == "feedback":
             # Request feedback on the bot's response
-            feedback = input("Was the response helpful? (yes/no): ").strip().lower()
+            feedback = (await utils.ainput("Was the response helpful? (yes/no): ")).strip().lower()
             if feedback == "no":
                 # If feedback is negative, request more details and thank the user for the feedback
-                additional_feedback = input("What was wrong with the response? ")
+                additional_feedback = await utils.ainput("What was wrong with the response? ")
                 print("Thank you for your feedback! We will try to improve.")
-                chat_history.append(("user", f"Feedback: {additional_feedback}"))
+                chat_history.add_feedback(f"Feedback: {additional_feedback}")
             elif feedback == "yes":
                 # Positive feedback acknowledgement
                 print("Glad to hear that!")
             continue
         # Invoke the agent with the current input and chat history to generate a response
-        response_q = queue.Queue()
-        ai_thread = threading.Thread(target=get_chat_response, args=(user_input, chat_history, response_q))
-        ai_thread.start()
-        
-        utils.print_dots(ai_thread)
-        
-        ai_thread.join()
-        
-        response = response_q.get()
-        print()
-        print("Bot:", response["output"])  # Display the bot's response
+        if stream:
+            output = await streaming.print_stream(astream_chat_response(user_input, chat_history))
+        else:
+            response = await utils.print_dots(aget_chat_response(user_input, chat_history))
+            output = response["output"]
+            print()
+            print("Bot:", output)  # Display the bot's response
         # Record user and bot messages in the chat history
-        chat_history.append(("user", user_input))
-        chat_history.append(("bot", response["output"]))
+        chat_history.add_turn(user_input, output)
         print()
         print('To provide feedback, enter "feedback"')
         print()
 
 if __name__ == "__main__":
-    run_chat()
+    parser = argparse.ArgumentParser(description="Chat with the movie chatbot.")
+    parser.add_argument("--stream", action="store_true", help="stream the response as it is generated")
+    run_chat(stream=parser.parse_args().stream)
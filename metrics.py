@@ -0,0 +1,369 @@
+"""
+This module records where the time of each chat turn goes. A slow answer can come from the
+agent's LLM call, the entity context query, the Cypher generation of the GraphCypherQAChain, the
+Cypher execution or the final answer generation; every one of these stages is recorded as a span
+of the turn, with token counts and cache or fallback outcomes.
+
+Key Components:
+- `turn`: Opens the record of one chat turn. Spans and events recorded while it is open (in the
+  same thread, in worker threads started with `asyncio.to_thread` and in callbacks) belong to it.
+  When it closes, the turn is appended as one JSON line to CHATBOT_TRACE_FILE, if set.
+- `span` and `count`: Time a stage of the current turn and count outcomes such as cache hits.
+- MetricsCallbackHandler: A LangChain callback handler timing the model calls of one stage and
+  reading their token usage.
+- TimedGraph: Wraps a graph so that every query is recorded as a span of a given stage.
+- `render_prometheus` and `start_http_server`: Export the aggregated latency histograms and
+  counters in the Prometheus text format (server.py serves them on `/metrics`).
+
+Functionality:
+- Recording is enabled with CHATBOT_METRICS=1. When it is disabled, `span` returns a shared no-op
+  context manager, `count` returns immediately and no callback handlers are attached, so the
+  overhead is a single attribute check per call site.
+"""
+
+
+# Standard library imports
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+import itertools
+import json
+import os
+import threading
+import time
+
+# Third-party imports
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Application-specific imports
+from graph_wrapper import GraphWrapper
+
+
+ENABLED = os.getenv("CHATBOT_METRICS", "0") == "1"
+TRACE_FILE = os.getenv("CHATBOT_TRACE_FILE")
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class _NoopSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span():
+    """
+    A timed stage of a turn.
+
+    Attributes:
+        stage (str): The name of the stage, e.g. "agent_llm" or "description_query".
+        attributes (Dict[str, Any]): Extra facts about the stage, such as tokens or outcome.
+    """
+
+    def __init__(self, stage: str, **attributes):
+        self.stage = stage
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.duration_ms = None
+
+    def set(self, **attributes) -> None:
+        """Attach attributes to the span, e.g. `span.set(outcome="hit")`."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.attributes.setdefault("error", exc_type.__name__)
+        _finish(self, time.perf_counter() - self.started)
+        return False
+
+
+class Turn():
+    """
+    The record of one chat turn: its spans and event counts.
+
+    Attributes:
+        turn_id (int): A number identifying the turn within the process.
+        spans (List[dict]): The finished spans, in the order they finished.
+        events (Dict[str, int]): Outcome counts, such as "context_cache_hit".
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, **attributes):
+        self.turn_id = next(self._ids)
+        self.attributes = attributes
+        self.started = time.time()
+        self.spans: List[dict] = []
+        self.events: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, span: dict) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def add_event(self, name: str, value: int) -> None:
+        with self._lock:
+            self.events[name] = self.events.get(name, 0) + value
+
+
+_current_turn: ContextVar[Optional[Turn]] = ContextVar("chatbot_turn", default=None)
+_lock = threading.Lock()
+_histograms: Dict[str, List[float]] = {}
+_counters: Dict[tuple, float] = {}
+
+
+def span(stage: str, **attributes):
+    """
+    Time a stage of the current turn.
+
+    Parameters:
+        stage (str): The name of the stage.
+        **attributes: Facts recorded with the span.
+
+    Returns:
+        A context manager whose `set` method adds attributes while the stage runs.
+    """
+    if not ENABLED:
+        return _NOOP
+    return Span(stage, **attributes)
+
+
+def count(event: str, value: int = 1) -> None:
+    """
+    Count an outcome, such as a cache hit or a fallback, in the current turn and the totals.
+
+    Parameters:
+        event (str): The name of the outcome.
+        value (int): The amount to add.
+    """
+    if not ENABLED:
+        return
+    turn_record = _current_turn.get()
+    if turn_record is not None:
+        turn_record.add_event(event, value)
+    with _lock:
+        key = ("chatbot_events_total", (("event", event),))
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextmanager
+def turn(**attributes):
+    """
+    Record one chat turn. Nested calls join the turn already open.
+
+    Parameters:
+        **attributes: Facts recorded with the turn, such as the session id.
+    """
+    if not ENABLED or _current_turn.get() is not None:
+        yield _current_turn.get()
+        return
+    record = Turn(**attributes)
+    token = _current_turn.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        try:
+            _current_turn.reset(token)
+        except ValueError:
+            pass  # A streamed turn closed from another task; its context is discarded anyway
+        duration = time.perf_counter() - started
+        _observe("turn", duration)
+        if TRACE_FILE:
+            _write_trace(record, duration)
+
+
+def _finish(finished: Span, duration: float) -> None:
+    finished.duration_ms = 1000 * duration
+    _observe(finished.stage, duration)
+    tokens = finished.attributes
+    with _lock:
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if tokens.get(kind):
+                key = ("chatbot_tokens_total", (("stage", finished.stage), ("kind", kind[:-len("_tokens")])))
+                _counters[key] = _counters.get(key, 0) + tokens[kind]
+    turn_record = _current_turn.get()
+    if turn_record is not None:
+        turn_record.add_span({"stage": finished.stage, "duration_ms": round(finished.duration_ms, 3),
+                              **finished.attributes})
+
+
+def _observe(stage: str, duration: float) -> None:
+    milliseconds = 1000 * duration
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            # One slot per bucket, then the +Inf bucket, the sum and the count
+            histogram = _histograms[stage] = [0.0] * (len(BUCKETS_MS) + 3)
+        for i, bound in enumerate(BUCKETS_MS):
+            if milliseconds <= bound:
+                histogram[i] += 1
+        histogram[-3] += 1
+        histogram[-2] += milliseconds
+        histogram[-1] += 1
+
+
+def _write_trace(record: Turn, duration: float) -> None:
+    line = json.dumps({"turn_id": record.turn_id, "started": record.started,
+                       "duration_ms": round(1000 * duration, 3), **record.attributes,
+                       "spans": record.spans, "events": record.events}, default=str)
+    with _lock:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def render_prometheus() -> str:
+    """
+    Render the aggregated metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: The latency histograms per stage, token counters and event counters.
+    """
+    lines = ["# TYPE chatbot_stage_duration_ms histogram"]
+    with _lock:
+        for stage, histogram in sorted(_histograms.items()):
+            for bound, value in zip(BUCKETS_MS, histogram):
+                lines.append(f'chatbot_stage_duration_ms_bucket{{stage="{stage}",le="{bound}"}} {value:g}')
+            lines.append(f'chatbot_stage_duration_ms_bucket{{stage="{stage}",le="+Inf"}} {histogram[-3]:g}')
+            lines.append(f'chatbot_stage_duration_ms_sum{{stage="{stage}"}} {histogram[-2]:g}')
+            lines.append(f'chatbot_stage_duration_ms_count{{stage="{stage}"}} {histogram[-1]:g}')
+        typed = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+            lines.append(f"{name}{{{label_text}}} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve `render_prometheus` on http://host:port/metrics from a background thread.
+
+    Parameters:
+        port (int): The port to listen on.
+        host (str): The interface to listen on.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records the model calls of one stage as spans, with their token usage.
+
+    Attributes:
+        stage (str): The stage the model calls belong to, e.g. "cypher_generation".
+    """
+
+    run_inline = True
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._spans: Dict[Any, Span] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._spans[run_id] = Span(self.stage)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self._spans[run_id] = Span(self.stage)
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        finished = self._spans.pop(run_id, None)
+        if finished is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        finished.set(prompt_tokens=usage.get("prompt_tokens", 0),
+                     completion_tokens=usage.get("completion_tokens", 0))
+        _finish(finished, time.perf_counter() - finished.started)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        finished = self._spans.pop(run_id, None)
+        if finished is not None:
+            finished.set(error=type(error).__name__)
+            _finish(finished, time.perf_counter() - finished.started)
+
+
+def with_metrics(model, stage: str):
+    """
+    Attach a MetricsCallbackHandler for a stage to a model, when metrics are enabled.
+
+    Parameters:
+        model (Runnable): The model, or a model binding.
+        stage (str): The stage its calls belong to.
+
+    Returns:
+        Runnable: The model, configured to report its calls.
+    """
+    if not ENABLED:
+        return model
+    return model.with_config(callbacks=[MetricsCallbackHandler(stage)])
+
+
+def timed_graph(graph, stage: str):
+    """
+    Wrap a graph in a TimedGraph for a stage, when metrics are enabled.
+
+    Parameters:
+        graph (GraphStore): The graph.
+        stage (str): The stage its queries belong to.
+
+    Returns:
+        GraphStore: The graph, recording its queries.
+    """
+    if not ENABLED:
+        return graph
+    return TimedGraph(graph, stage)
+
+
+class TimedGraph(GraphWrapper):
+    """
+    A graph wrapper recording every query as a span of one stage.
+
+    Attributes:
+        graph (GraphStore): The wrapped graph.
+        stage (str): The stage the queries belong to, e.g. "cypher_execution".
+    """
+
+    def __init__(self, graph, stage: str):
+        super().__init__(graph)
+        self.stage = stage
+
+    def query(self, query: str, params: dict = {}) -> List[Dict[str, Any]]:
+        with span(self.stage) as timed:
+            rows = self.graph.query(query, params)
+            timed.set(rows=len(rows))
+            return rows
@@ -7,9 +7,23 @@ for generating precise, schema-aware Cypher queries in response to natural langu
 Key Components:
 - `description_query`: A comprehensive Cypher query template for retrieving detailed 
   context about movies or persons within the graph, including their related entities.
+- `description_by_id_query`, `entity_index_query`: Fetch the context of a node by its element
+  id, and list every movie and person to build the in-process entity index.
+- `descriptions_by_ids_query`: Fetches the contexts of several nodes with one UNWIND, for
+  questions about more than one entity.
+- `all_contexts_query`: Builds the context of every movie and person at once, to precompute the
+  on-disk context store.
+- `actors_by_id_query`, `directors_by_id_query`, `movie_count_by_id_query`: Answer the most 
+  frequent question shapes directly for the fast-path router.
+- `graph_version_query`: Reads a cheap version stamp used to invalidate cached entity contexts.
+- `replica_nodes_query`, `replica_relationships_query`, `replica_changed_relationships_query`,
+  `replica_counts_query`: Load the local graph replica, in full or only the nodes changed since
+  its last refresh.
 - `prefix`, `suffix`, `examples`: These elements define the structure and examples for 
   constructing few-shot learning prompts that guide the language model to generate 
   syntactically correct and contextually appropriate Cypher queries.
+- `history_summary_prompt`: Asks the language model to fold older turns of a conversation into 
+  a running summary, keeping the chat history within its token budget.
 - `agent_system_prompt`: Provides a detailed directive for the language model, ensuring 
   responses are consistently derived from the database and adhere to specific user queries.
 
@@ -24,9 +38,7 @@ Usage:
 """
 
 
-description_query = """
-MATCH (m:Movie|Person)
-WHERE m.title CONTAINS $candidate OR m.name CONTAINS $candidate
+context_aggregation = """
 MATCH (m)-[r:ACTED_IN|WROTE|DIRECTED|REVIEWED|PRODUCED|FOLLOWS]-(t)
 WITH m, type(r) as type, collect(coalesce(t.name, t.title)) as names
 WITH m, type+": "+reduce(s="", n IN names | s + n + ", ") as types
@@ -34,8 +46,96 @@ WITH m, collect(types) as contexts
 WITH m, "type:" + labels(m)[0] + "\ntitle: "+ coalesce(m.title, m.name) 
        + "\nyear: "+coalesce(m.released,"") +"\n" +
        reduce(s="", c in contexts | s + substring(c, 0, size(c)-2) +"\n") as context
-RETURN context LIMIT 1
 """
+
+context_projection = context_aggregation + """RETURN context LIMIT 1
+"""
+
+description_query = """
+MATCH (m:Movie|Person)
+WHERE m.title CONTAINS $candidate OR m.name CONTAINS $candidate
+""" + context_projection
+
+# Looks up the context of a node already resolved by the in-process entity index
+description_by_id_query = """
+MATCH (m:Movie|Person)
+WHERE elementId(m) = $id
+""" + context_projection
+
+# Looks up the contexts of several resolved nodes in one round trip; nodes without context return no row
+descriptions_by_ids_query = """
+UNWIND $ids AS id
+MATCH (m:Movie|Person)
+WHERE elementId(m) = id
+""" + context_aggregation + """RETURN elementId(m) AS id, context
+"""
+
+# Materializes the context of every entity at once, for the context store (see context_store.py)
+all_contexts_query = """
+MATCH (m:Movie|Person)
+""" + context_aggregation + """RETURN elementId(m) AS id, context
+"""
+
+# Parameterized queries answering frequent question shapes without the agent (see router.py)
+actors_by_id_query = """
+MATCH (m:Movie)<-[:ACTED_IN]-(p:Person)
+WHERE elementId(m) = $id
+RETURN m.title AS title, collect(p.name) AS names
+"""
+
+directors_by_id_query = """
+MATCH (m:Movie)<-[:DIRECTED]-(p:Person)
+WHERE elementId(m) = $id
+RETURN m.title AS title, collect(p.name) AS names
+"""
+
+movie_count_by_id_query = """
+MATCH (p:Person)
+WHERE elementId(p) = $id
+OPTIONAL MATCH (p)-[:ACTED_IN]->(m:Movie)
+RETURN p.name AS name, count(m) AS movies
+"""
+
+# Cheap version stamp of the graph: an optional counter node bumped by writers, plus the
+# node and relationship counts (served from the count store)
+graph_version_query = """
+OPTIONAL MATCH (v:GraphVersion)
+WITH max(v.version) AS version
+RETURN version, COUNT { MATCH (n) } AS nodes, COUNT { MATCH ()-[r]->() } AS relationships
+"""
+
+# Local read replica of the graph (see graph_replica.py). The relationship types are those of
+# `context_projection`; `updatedAt` is a numeric timestamp set by writers on changed nodes.
+replica_nodes_query = """
+MATCH (n)
+WHERE $since IS NULL OR n.updatedAt > $since
+RETURN elementId(n) AS id, labels(n) AS labels, n.title AS title, n.name AS name,
+       n.released AS released, n.updatedAt AS updated
+"""
+
+replica_relationships_query = """
+MATCH (a)-[r:ACTED_IN|WROTE|DIRECTED|REVIEWED|PRODUCED|FOLLOWS]->(b)
+RETURN elementId(r) AS id, elementId(a) AS source, type(r) AS type, elementId(b) AS target
+"""
+
+replica_changed_relationships_query = """
+UNWIND $ids AS id
+MATCH (a)-[r:ACTED_IN|WROTE|DIRECTED|REVIEWED|PRODUCED|FOLLOWS]-()
+WHERE elementId(a) = id
+RETURN DISTINCT elementId(r) AS id, elementId(startNode(r)) AS source, type(r) AS type,
+       elementId(endNode(r)) AS target
+"""
+
+replica_counts_query = """
+RETURN COUNT { MATCH (n) } AS nodes,
+       COUNT { MATCH ()-[r:ACTED_IN|WROTE|DIRECTED|REVIEWED|PRODUCED|FOLLOWS]->() } AS relationships
+"""
+
+entity_index_query = """
+MATCH (m:Movie|Person)
+RETURN elementId(m) AS id, labels(m)[0] AS label, coalesce(m.title, m.name) AS name
+"""
+
 prefix = """
 You are a Neo4j expert. Given an input question, create a syntactically correct 
 Cypher query to run.\n\nHere is the schema information {schema}. Use only the provided 
@@ -80,8 +180,22 @@ examples = [
     },
 ]
 
+history_summary_prompt = """
+Progressively summarize the conversation between a user and a movie chatbot. Extend the current 
+summary with the new lines and return only the new summary, in at most 100 words. Keep the names 
+of movies and people that were mentioned and any preferences the user expressed.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{turns}
+
+New summary:"""
+
 agent_system_prompt = "You are a helpful assistant that finds information about movies, actors, directors, etc., from the graph database. \
              Each user input must be processed by querying the graph database using the InformationTool. \
+             When a user input mentions several movies or people, pass all of them to a single InformationTool call. \
              Ensure each response is directly derived from the database query results. \
              Before finalizing any response, confirm a query to the database has been logged and validated. \
              If a user input does not trigger a database query, reprocess the input to include such a query. \
@@ -0,0 +1,200 @@
+"""
+This module answers the most frequent question shapes without going through the agent. Every
+agent turn costs at least two GPT round trips (one to decide to call the InformationTool, one to
+phrase its result), yet questions such as "Who played in The Matrix?" always map to the same
+parameterized Cypher query.
+
+Key Components:
+- Route: A regular expression over the normalized question, the Cypher query run for the matched
+  entity and the function rendering the answer from its rows.
+- FastPathRouter: Matches a user input against the routes, resolves the entity with the entity
+  index (exact matches only, so the fast path never guesses), runs the query and renders the
+  answer. Anything it cannot answer with certainty is left to the agent.
+
+Supported shapes:
+- "Who played in X?", "Who acted in X?", "Which actors played in the movie X?"
+- "Who directed X?"
+- "How many movies has P acted in?"
+- "Tell me (more) about X", "What do you know about X?"
+
+Usage:
+- `main.respond` consults `FastPathRouter.route` before invoking the agent.
+"""
+
+
+# Standard library imports
+from typing import Callable, List, NamedTuple, Optional, Pattern
+import re
+
+# Application-specific imports
+from cypher_cache import normalize_question
+import prompts
+
+
+def _join(names: List[str]) -> str:
+    names = sorted(names)
+    return names[0] if len(names) == 1 else ", ".join(names[:-1]) + " and " + names[-1]
+
+
+def _render_actors(rows: List[dict]) -> Optional[str]:
+    if not rows or not rows[0]["names"]:
+        return None
+    return f"The actors in {rows[0]['title']} are {_join(rows[0]['names'])}."
+
+
+def _render_directors(rows: List[dict]) -> Optional[str]:
+    if not rows or not rows[0]["names"]:
+        return None
+    return f"{rows[0]['title']} was directed by {_join(rows[0]['names'])}."
+
+
+def _render_movie_count(rows: List[dict]) -> Optional[str]:
+    if not rows:
+        return None
+    count = rows[0]["movies"]
+    return f"{rows[0]['name']} has acted in {count} movie{'' if count == 1 else 's'}."
+
+
+# Sentences for the relationships listed in an entity context, by the label of the entity
+_MOVIE_RELATIONSHIPS = {
+    "ACTED_IN": "Its cast includes {names}.",
+    "DIRECTED": "It was directed by {names}.",
+    "WROTE": "It was written by {names}.",
+    "PRODUCED": "It was produced by {names}.",
+    "REVIEWED": "It was reviewed by {names}.",
+}
+_PERSON_RELATIONSHIPS = {
+    "ACTED_IN": "{subject} acted in {names}.",
+    "DIRECTED": "{subject} directed {names}.",
+    "WROTE": "{subject} wrote {names}.",
+    "PRODUCED": "{subject} produced {names}.",
+    "REVIEWED": "{subject} reviewed {names}.",
+    "FOLLOWS": "{subject} follows or is followed by {names}.",
+}
+
+
+def _render_context(rows: List[dict]) -> Optional[str]:
+    # Parses the context format of `prompts.context_aggregation`: the label, title and year of the
+    # entity, then one "TYPE: name, name" line per relationship type
+    if not rows or not rows[0]["context"]:
+        return None
+    fields, relationships = {}, []
+    for line in rows[0]["context"].splitlines():
+        key, _, value = line.partition(":")
+        key, value = key.strip(), value.strip()
+        if key in ("type", "title", "year"):
+            fields[key] = value
+        elif value:
+            relationships.append((key, value.split(", ")))
+    title = fields.get("title")
+    if not title or fields.get("type") not in ("Movie", "Person"):
+        return None
+    if fields["type"] == "Movie":
+        year = fields.get("year")
+        sentences = [f"{title} is a movie released in {year}." if year else f"{title} is a movie."]
+        templates = _MOVIE_RELATIONSHIPS
+    else:
+        sentences = []
+        templates = _PERSON_RELATIONSHIPS
+    for type_, names in relationships:
+        if type_ in templates:
+            sentences.append(templates[type_].format(subject=title, names=_join(names)))
+    # A person without any known relationship is left to the agent
+    return " ".join(sentences) or None
+
+
+class Route(NamedTuple):
+    """
+    A question shape the router can answer.
+
+    Attributes:
+        name (str): A short identifier of the route.
+        pattern (Pattern): Matches the normalized question and captures the `entity` group.
+        query (Optional[str]): The Cypher run with the entity's node id, or None to answer from the
+            entity's context, passed to `render` as a single row with a `context` column.
+        render (Callable[[List[dict]], Optional[str]]): Builds the answer from the query rows, or
+            returns None when they do not answer the question.
+    """
+    name: str
+    pattern: Pattern
+    query: Optional[str]
+    render: Callable[[List[dict]], Optional[str]]
+
+
+ROUTES = [
+    Route(
+        "actors",
+        re.compile(r"^(?:who (?:played|acted|starred|was|were) in|who are the actors in|"
+                   r"which actors (?:played|acted|starred) in)(?: the movie)? (?P<entity>.+)$"),
+        prompts.actors_by_id_query,
+        _render_actors,
+    ),
+    Route(
+        "directors",
+        re.compile(r"^(?:who directed|who is the director of|who was the director of)(?: the movie)? (?P<entity>.+)$"),
+        prompts.directors_by_id_query,
+        _render_directors,
+    ),
+    Route(
+        "movie_count",
+        re.compile(r"^how many (?:movies|films) (?:has|did|have) (?P<entity>.+?) (?:acted|act|starred|star|played|play) in$"),
+        prompts.movie_count_by_id_query,
+        _render_movie_count,
+    ),
+    Route(
+        "context",
+        re.compile(r"^(?:tell me (?:more )?about|what do you know about)(?: the movie)? (?P<entity>.+)$"),
+        None,
+        _render_context,
+    ),
+]
+
+
+class FastPathRouter():
+    """
+    Answers frequent, unambiguous question shapes with parameterized Cypher.
+
+    Attributes:
+        graph (Neo4jGraph): The graph the route queries run against.
+        entity_index (EntityIndex): Resolves the entity named in the question.
+        context_lookup (Callable[[str], str]): Returns the context of a node id, used to answer
+            "tell me about" questions.
+        routes (List[Route]): The question shapes tried, in order.
+    """
+
+    def __init__(self, graph, entity_index, context_lookup: Callable[[str], str], routes: List[Route] = ROUTES):
+        self.graph = graph
+        self.entity_index = entity_index
+        self.context_lookup = context_lookup
+        self.routes = routes
+
+    def route(self, user_input: str, chat_history=None) -> Optional[str]:
+        """
+        Answer a user input on the fast path, if it has one of the supported shapes.
+
+        Parameters:
+            user_input (str): The natural language input from a user.
+            chat_history (HistoryManager): The conversation so far. Pinned feedback may change how
+                answers must be phrased, so such conversations always go to the agent.
+
+        Returns:
+            Optional[str]: The answer, or None when the input must be handled by the agent.
+        """
+        if chat_history is not None and getattr(chat_history, "pinned", None):
+            return None
+        question = normalize_question(user_input)
+        for route in self.routes:
+            match = route.pattern.match(question)
+            if match is None:
+                continue
+            node_id = self.entity_index.resolve(match.group("entity"), exact=True)
+            if node_id is None:
+                return None
+            if route.query is None:
+                try:
+                    context = self.context_lookup(node_id)
+                except IndexError:
+                    return None
+                return route.render([{"context": context}])
+            return route.render(self.graph.query(route.query, params={"id": node_id}))
+        return None
@@ -0,0 +1,247 @@
+"""
+This module serves the movie chatbot to many users at once from a single process. Each
+conversation is an independent session with its own chat history, and every turn runs as a
+coroutine on one asyncio event loop via `AgentExecutor.ainvoke`, so a process is no longer limited
+to one conversation that blocks an OS thread while it waits on OpenAI and Neo4j.
+
+Key Components:
+- ChatSession: The state of one conversation, its chat history and the semaphore that limits how
+  many of its turns run at the same time.
+- ChatEngine: Creates and expires sessions and runs turns under a global cap on the number of
+  turns in flight.
+- `create_app`: Builds the aiohttp application exposing the engine over HTTP and websockets.
+
+Endpoints:
+- `POST /sessions/{session_id}/messages`: Body `{"input": "..."}` answers a question, body
+  `{"feedback": "..."}` records feedback for the session. Responds with `{"output": "..."}`.
+- `GET /sessions/{session_id}/ws`: A websocket accepting the same JSON messages (or plain text
+  questions) and replying with one JSON message per turn. With `"stream": true` the turn is
+  streamed as `tool`, `token` and `final` events instead (see `main.astream_chat_response`).
+- `DELETE /sessions/{session_id}`: Forgets a session.
+- Errors are answered with `{"error": "..."}`: status 400 for an invalid payload, 500 when the
+  turn itself failed. A websocket reports both and stays open for the next message.
+- `GET /metrics`: The per-stage latency histograms and counters of `metrics`, in the Prometheus
+  text format (recorded when CHATBOT_METRICS=1).
+
+Usage:
+- Run `python server.py --port 8080`. `SERVER_MAX_IN_FLIGHT` and `SERVER_SESSION_CONCURRENCY`
+  override the global and per-session concurrency limits.
+"""
+
+
+# Standard library imports
+from typing import AsyncIterator, Dict
+import argparse
+import asyncio
+import json
+import os
+import time
+
+# Third-party imports
+from aiohttp import WSMsgType, web
+
+# Application-specific imports
+import main
+import metrics
+
+
+class ChatSession():
+    """
+    A single conversation served by the ChatEngine.
+
+    Attributes:
+        session_id (str): The identifier chosen by the client.
+        chat_history (HistoryManager): The token-budgeted conversation so far.
+        semaphore (asyncio.Semaphore): Limits the number of concurrent turns of this session.
+        last_used (float): The monotonic time of the last turn, used to expire idle sessions.
+    """
+
+    def __init__(self, session_id: str, max_concurrency: int = 1):
+        self.session_id = session_id
+        self.chat_history = main.new_chat_history()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.last_used = time.monotonic()
+
+
+class ChatEngine():
+    """
+    Runs the turns of many sessions concurrently on the current event loop.
+
+    Attributes:
+        max_in_flight (int): The maximum number of turns running across all sessions.
+        session_concurrency (int): The maximum number of turns running per session. The default
+            of one keeps the turns of a conversation in order.
+        session_ttl (float): Seconds of inactivity after which a session is forgotten.
+    """
+
+    def __init__(self, max_in_flight: int = 64, session_concurrency: int = 1,
+                 session_ttl: float = 3600.0):
+        self.max_in_flight = max_in_flight
+        self.session_concurrency = session_concurrency
+        self.session_ttl = session_ttl
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._sessions: Dict[str, ChatSession] = {}
+
+    def session(self, session_id: str) -> ChatSession:
+        """Return the session with the given id, creating it if needed."""
+        self._expire_sessions()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = ChatSession(session_id, self.session_concurrency)
+        return session
+
+    def close_session(self, session_id: str) -> None:
+        """Forget a session and its chat history."""
+        self._sessions.pop(session_id, None)
+
+    async def chat(self, session_id: str, user_input: str) -> str:
+        """
+        Answer a user input within a session, waiting for a free slot if the limits are reached.
+
+        Parameters:
+            session_id (str): The session the input belongs to.
+            user_input (str): The natural language input from a user.
+
+        Returns:
+            str: The bot's response.
+        """
+        session = self.session(session_id)
+        async with session.semaphore, self._in_flight:
+            with metrics.turn(session=session_id):
+                response = await main.aget_chat_response(user_input, session.chat_history)
+        session.chat_history.add_turn(user_input, response["output"])
+        session.last_used = time.monotonic()
+        return response["output"]
+
+    async def astream(self, session_id: str, user_input: str) -> AsyncIterator[dict]:
+        """
+        Answer a user input within a session, yielding the events of `main.astream_chat_response`.
+
+        Parameters:
+            session_id (str): The session the input belongs to.
+            user_input (str): The natural language input from a user.
+
+        Yields:
+            dict: Tool progress, answer tokens and finally the complete output.
+        """
+        session = self.session(session_id)
+        async with session.semaphore, self._in_flight:
+            with metrics.turn(session=session_id):
+                async for event in main.astream_chat_response(user_input, session.chat_history):
+                    if event["type"] == "final":
+                        session.chat_history.add_turn(user_input, event["content"])
+                        session.last_used = time.monotonic()
+                    yield event
+
+    def feedback(self, session_id: str, feedback: str) -> None:
+        """Record feedback on the previous responses of a session."""
+        self.session(session_id).chat_history.add_feedback(f"Feedback: {feedback}")
+
+    def _expire_sessions(self) -> None:
+        deadline = time.monotonic() - self.session_ttl
+        for session_id in [key for key, session in self._sessions.items() if session.last_used < deadline]:
+            del self._sessions[session_id]
+
+
+# Sent instead of the details of an unexpected failure, which are printed on the server
+FAILURE_REPLY = "Sorry, something went wrong while answering. Please try again."
+
+
+def _check_payload(payload) -> dict:
+    if not isinstance(payload, dict):
+        raise ValueError("Expected a JSON object")
+    if "feedback" not in payload and not payload.get("input"):
+        raise ValueError('Expected an "input" or a "feedback" field')
+    return payload
+
+
+async def _handle_payload(engine: ChatEngine, session_id: str, payload: dict) -> dict:
+    if "feedback" in payload:
+        engine.feedback(session_id, str(payload["feedback"]))
+        return {"output": "Thank you for your feedback! We will try to improve."}
+    return {"output": await engine.chat(session_id, str(payload["input"]))}
+
+
+async def post_message(request: web.Request) -> web.Response:
+    engine = request.app["engine"]
+    session_id = request.match_info["session_id"]
+    try:
+        payload = _check_payload(await request.json())
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    try:
+        return web.json_response(await _handle_payload(engine, session_id, payload))
+    except Exception as e:
+        print(f"Failed to answer in session {session_id}: {type(e).__name__}: {e}")
+        return web.json_response({"error": FAILURE_REPLY}, status=500)
+
+
+async def websocket(request: web.Request) -> web.WebSocketResponse:
+    engine = request.app["engine"]
+    session_id = request.match_info["session_id"]
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    async for message in ws:
+        if message.type != WSMsgType.TEXT:
+            continue
+        try:
+            payload = json.loads(message.data)
+        except ValueError:
+            payload = {"input": message.data}
+        try:
+            payload = _check_payload(payload)
+        except ValueError as e:
+            await ws.send_json({"error": str(e)})
+            continue
+        # A failed turn is reported on the socket, which stays open for the session's next message
+        try:
+            if payload.get("stream") and payload.get("input"):
+                async for event in engine.astream(session_id, str(payload["input"])):
+                    await ws.send_json(event)
+            else:
+                await ws.send_json(await _handle_payload(engine, session_id, payload))
+        except Exception as e:
+            print(f"Failed to answer in session {session_id}: {type(e).__name__}: {e}")
+            await ws.send_json({"error": FAILURE_REPLY})
+    return ws
+
+
+async def delete_session(request: web.Request) -> web.Response:
+    request.app["engine"].close_session(request.match_info["session_id"])
+    return web.Response(status=204)
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+
+def create_app(engine: ChatEngine = None) -> web.Application:
+    """
+    Build the aiohttp application serving the chatbot.
+
+    Parameters:
+        engine (ChatEngine): The engine to serve; one configured from the environment by default.
+
+    Returns:
+        web.Application: The application, ready for `web.run_app`.
+    """
+    if engine is None:
+        engine = ChatEngine(
+            max_in_flight=int(os.getenv("SERVER_MAX_IN_FLIGHT", "64")),
+            session_concurrency=int(os.getenv("SERVER_SESSION_CONCURRENCY", "1")),
+        )
+    app = web.Application()
+    app["engine"] = engine
+    app.router.add_post("/sessions/{session_id}/messages", post_message)
+    app.router.add_get("/sessions/{session_id}/ws", websocket)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_get("/metrics", metrics_endpoint)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the movie chatbot over HTTP and websockets.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,235 @@
+"""
+This module coalesces identical lookups that are in flight at the same time. When a popular title
+trends, many sessions ask about it at once, and each of them would otherwise run its own context
+query against Neo4j and often its own Cypher generation against OpenAI.
+
+Key Components:
+- SingleFlight: Runs one execution per key at a time. Callers arriving while it runs wait for it
+  and receive its result, or its exception, instead of starting their own. Threads wait with `do`
+  and coroutines with `ado`, and both kinds of caller can share the same execution; a coroutine
+  waiting for an execution does not occupy a thread.
+- A waiting caller is bound by its own turn's deadline, not the first caller's: it stops waiting
+  with DeadlineExceeded once its own time is up, and when the execution it waited for ran out of
+  the first caller's time, it starts a new execution instead of inheriting that failure.
+- CoalescedRun: Runs a refresh-like function in one thread at a time. A request made while it
+  runs returns at once and makes the running call go once more afterwards, so a change reported
+  mid-run is never dropped and any number of such requests collapse into one extra run.
+
+Functionality:
+- Nothing is cached: once an execution finishes, the next call starts a new one. Coalescing only
+  removes the duplicates of work already running, so results are never staler than the time the
+  first caller waited for.
+
+Usage:
+- `main.get_information` coalesces calls on the normalized entity and question, the entity
+  context lookups on the node id and the Cypher chain on the normalized question.
+- `graph_replica.GraphReplica.refresh` and `entity_index.EntityIndex.refresh_in_background` run
+  through a CoalescedRun.
+"""
+
+
+# Standard library imports
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+import asyncio
+import threading
+
+# Application-specific imports
+from deadline import DeadlineExceeded
+import deadline
+import metrics
+
+
+class _Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight():
+    """
+    Shares one in-flight execution between concurrent callers with the same key.
+
+    Attributes:
+        name (str): Identifies the group in metrics, e.g. "entity_context".
+        executions (int): The number of executions started.
+        coalesced (int): The number of calls served by another caller's execution.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.executions = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Call `fn(*args, **kwargs)`, unless a call with the same key is already running, in which
+        case wait for it and share its outcome.
+
+        Parameters:
+            key (Hashable): Identifies calls that are interchangeable.
+            fn (Callable): The function to run.
+
+        Returns:
+            Any: The result of the execution.
+
+        Raises:
+            DeadlineExceeded: If this caller's deadline passes while it waits.
+            Exception: The exception raised by the execution.
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                self._run(key, call, fn, args, kwargs)
+            else:
+                left = deadline.remaining()
+                if not call.done.wait(None if left is None else max(left, 0)):
+                    self._expired()
+                if self._retry(call):
+                    continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+    async def ado(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Like `do`, for coroutines: the function runs in a worker thread when this caller starts
+        the execution, and the caller awaits it without a thread otherwise.
+
+        Parameters:
+            key (Hashable): Identifies calls that are interchangeable.
+            fn (Callable): The (blocking) function to run.
+
+        Returns:
+            Any: The result of the execution.
+
+        Raises:
+            DeadlineExceeded: If this caller's deadline passes while it waits.
+            Exception: The exception raised by the execution.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            waiter = (loop, loop.create_future())
+            call, leader = self._join(key, waiter)
+            if leader:
+                await asyncio.to_thread(self._run, key, call, fn, args, kwargs)
+            else:
+                left = deadline.remaining()
+                try:
+                    await asyncio.wait_for(waiter[1], None if left is None else max(left, 0))
+                except asyncio.TimeoutError:
+                    self._leave(call, waiter)
+                    self._expired()
+                if self._retry(call):
+                    continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+    def _join(self, key: Hashable, waiter: Tuple = None) -> Tuple[_Call, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                return call, True
+            if waiter is not None:
+                call.waiters.append(waiter)
+            self.coalesced += 1
+        metrics.count(f"{self.name}_coalesced")
+        return call, False
+
+    def _leave(self, call: _Call, waiter: Tuple) -> None:
+        # A coroutine that gave up waiting no longer needs to be woken
+        with self._lock:
+            if waiter in call.waiters:
+                call.waiters.remove(waiter)
+
+    def _expired(self) -> None:
+        metrics.count("deadline_exceeded")
+        raise DeadlineExceeded(f"Deadline exceeded while waiting for {self.name}")
+
+    def _retry(self, call: _Call) -> bool:
+        # The execution ran out of its first caller's time; a caller that still has time starts
+        # a new one rather than failing with somebody else's deadline
+        if not isinstance(call.error, DeadlineExceeded):
+            return False
+        left = deadline.remaining()
+        return left is None or left > 0
+
+    def _run(self, key: Hashable, call: _Call, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                # Later callers start a new execution; those already waiting are released below
+                del self._calls[key]
+                waiters, call.waiters = call.waiters, []
+                call.done.set()
+            for loop, future in waiters:
+                loop.call_soon_threadsafe(_resolve, future)
+
+
+class CoalescedRun():
+    """
+    Runs a function in one thread at a time, rerunning it once for the requests made meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Set by every request, cleared by the run that serves it
+        self._pending = False
+
+    def run(self, fn: Callable[..., Any], *args) -> bool:
+        """
+        Call `fn(*args)` now, or leave it to the call already running, which then runs it once more.
+
+        Parameters:
+            fn (Callable): The function to run.
+
+        Returns:
+            bool: Whether this call ran the function, rather than the one already running.
+        """
+        # Flagged before trying the lock, so a running call either sees the flag or has already
+        # released the lock
+        self._pending = True
+        ran = False
+        while self._pending:
+            if not self._lock.acquire(blocking=False):
+                return ran
+            try:
+                self._pending = False
+                fn(*args)
+            finally:
+                self._lock.release()
+            ran = True
+        return ran
+
+    def start(self, fn: Callable[..., Any], *args) -> Optional[threading.Thread]:
+        """
+        Like `run`, from a background daemon thread. Errors raised by `fn` end the thread, so it
+        should report them itself.
+
+        Parameters:
+            fn (Callable): The function to run.
+
+        Returns:
+            Optional[threading.Thread]: The thread started, or None when a run is in progress and
+                will run the function once more itself.
+        """
+        self._pending = True
+        if self._lock.locked():
+            return None
+        thread = threading.Thread(target=self.run, args=(fn, *args), daemon=True)
+        thread.start()
+        return thread
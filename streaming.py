@@ -0,0 +1,89 @@
+"""
+This module streams the chatbot's responses as they are generated, instead of waiting for the
+whole `AgentExecutor` run to finish. Final-answer tokens from the agent's language model are
+forwarded as soon as they arrive, and tool calls are reported as progress events, which brings
+the time to first token down from the full turn latency to a single model round trip.
+
+Key Components:
+- `astream_chat`: Runs one turn with `AgentExecutor.astream_events` and yields simplified events:
+  `{"type": "tool", ...}` when the graph is queried, `{"type": "token", ...}` for every piece of
+  the answer and a single `{"type": "final", ...}` carrying the complete output.
+- `print_stream`: Renders those events in the console and returns the final output.
+
+Usage:
+- `main.run_chat(stream=True)`, `demos.run_chat(stream=True)` and the websocket endpoint of
+  `server.py` (with `"stream": true` in the message) are built on `astream_chat`, through
+  `main.astream_chat_response` which answers fast-path questions without the agent. The agent's
+  model must carry the `AGENT_LLM_TAG` tag for its tokens to be forwarded.
+"""
+
+
+# Standard library imports
+from typing import AsyncIterator
+
+# Application-specific imports
+from history import HistoryManager
+
+
+# Tag carried by the agent's own model so its tokens can be told apart from the QA chain's
+AGENT_LLM_TAG = "agent_llm"
+
+
+async def astream_chat(agent_executor, user_input: str,
+                       chat_history: HistoryManager) -> AsyncIterator[dict]:
+    """
+    Run one turn of the agent, yielding progress, answer tokens and the final output.
+
+    Parameters:
+        agent_executor (AgentExecutor): The executor running the agent.
+        user_input (str): The natural language input from a user.
+        chat_history (HistoryManager): The conversation so far.
+
+    Yields:
+        dict: Events with a `type` of "tool", "token" or "final" and their `content`.
+    """
+    inputs = {"input": user_input, "chat_history": chat_history}
+    async for event in agent_executor.astream_events(inputs, version="v2"):
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            # Only the agent's own model produces the answer; the QA chain's models run inside
+            # the tool and tool-call chunks carry no content
+            chunk = event["data"]["chunk"]
+            if AGENT_LLM_TAG in event.get("tags", []) and chunk.content:
+                yield {"type": "token", "content": chunk.content}
+        elif kind == "on_tool_start":
+            tool_input = event["data"].get("input") or {}
+            entities = tool_input.get("entities", "") if isinstance(tool_input, dict) else tool_input
+            if isinstance(entities, list):
+                entities = ", ".join(entities)
+            yield {"type": "tool", "content": f"querying graph for {entities}"}
+        elif kind == "on_chain_end" and event["name"] == agent_executor.get_name():
+            yield {"type": "final", "content": event["data"]["output"]["output"]}
+
+
+async def print_stream(events: AsyncIterator[dict]) -> str:
+    """
+    Stream one turn to the console.
+
+    Parameters:
+        events (AsyncIterator[dict]): The events of the turn, as yielded by `astream_chat`.
+
+    Returns:
+        str: The complete output of the turn.
+    """
+    output, answering = "", False
+    async for event in events:
+        if event["type"] == "tool":
+            print(f"({event['content']}...)", flush=True)
+        elif event["type"] == "token":
+            if not answering:
+                print("Bot: ", end="", flush=True)
+                answering = True
+            print(event["content"], end="", flush=True)
+        else:
+            output = event["content"]
+    # Some turns end without streamed tokens (e.g. an answer produced in one chunk)
+    if not answering:
+        print("Bot:", output, end="")
+    print()
+    return output
@@ -7,10 +7,13 @@ and providing visual feedback during processing delays.
 Key Functions:
 - `format_chat_history`: Converts a list of raw chat tuples into a formatted list of 
   HumanMessage and AIMessage objects, enhancing clarity and structure in the display of 
-  chat interactions.
-- `print_dots`: Provides real-time visual feedback by printing dots in the console as 
-  a background thread processes tasks, useful for maintaining user engagement during 
-  potentially long-running operations.
+  chat interactions. A `history.HistoryManager` is passed through as its budgeted messages.
+- `print_dots`: Provides real-time visual feedback by printing dots in the console while 
+  a coroutine is awaited, useful for maintaining user engagement during potentially 
+  long-running operations.
+- `ainput`: Reads a line from the console without blocking the event loop.
+- `lazy`: Turns a factory into a getter that builds its object once, on first use, so 
+  expensive resources such as database connections are not created at import time.
 
 Usage:
 - These functions can be integrated into chatbots or any interactive systems where users 
@@ -20,30 +23,79 @@ Usage:
 
 
 # Standard library imports
-from typing import List, Tuple
-import time
+from typing import Awaitable, Callable, List, Tuple, TypeVar, Union
+import asyncio
+import functools
+import threading
 # Third-party imports
 from langchain_core.messages import AIMessage, HumanMessage
 
+# Application-specific imports
+from history import HistoryManager
 
-def format_chat_history(chat_history: List[Tuple[str, str]]):
+
+def format_chat_history(chat_history: Union[HistoryManager, List[Tuple[str, str]]]):
     """
     Format the chat history to be more user-friendly.
     
     Parameters:
-        chat_history (List[Tuple[str, str]]): The list of chat message tuples (user, bot).
+        chat_history (Union[HistoryManager, List[Tuple[str, str]]]): A token-budgeted history
+            manager, or the list of chat message tuples (user, bot).
 
     Returns:
         List[HumanMessage, AIMessage]: A list of formatted chat messages.
     """
+    if isinstance(chat_history, HistoryManager):
+        # The manager keeps its messages built and within the token budget already
+        return chat_history.messages()
     buffer = []
     for human, ai in chat_history:
         buffer.append(HumanMessage(content=human))
         buffer.append(AIMessage(content=ai))
     return buffer
     
-def print_dots(function_thread):
-    # Print a dot every second while function_thread is still running
-    while function_thread.is_alive():
+T = TypeVar("T")
+
+
+async def print_dots(awaitable: Awaitable[T]) -> T:
+    # Print a dot every second while the awaitable is still running, then return its result
+    task = asyncio.ensure_future(awaitable)
+    while not task.done():
         print(".", end="", flush=True)
-        time.sleep(1)
+        await asyncio.wait([task], timeout=1)
+    return task.result()
+
+async def ainput(prompt: str = "") -> str:
+    # Read from stdin in a worker thread so other coroutines keep running meanwhile
+    return await asyncio.to_thread(input, prompt)
+
+def lazy(factory: Callable[[], T]) -> Callable[[], T]:
+    """
+    Build the result of a factory on the first call and return the same object afterwards.
+
+    Parameters:
+        factory (Callable[[], T]): A function without arguments creating the object.
+
+    Returns:
+        Callable[[], T]: The getter. Its `reset` method forgets the object so that the next
+        call builds a new one, and its `override` method replaces the object, e.g. with a
+        stand-in for benchmarks.
+    """
+    lock = threading.RLock()
+    built = []
+
+    @functools.wraps(factory)
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(factory())
+        return built[0]
+
+    def override(value: T) -> None:
+        with lock:
+            built[:] = [value]
+
+    get.reset = built.clear
+    get.override = override
+    return get